@@ -0,0 +1,102 @@
+import json
+import time
+import asyncio
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT, ADMISSION_REJECTED
+from config import (
+    READ_CONCURRENCY, READ_QUEUE_SIZE, WRITE_CONCURRENCY, WRITE_QUEUE_SIZE,
+    ADMISSION_QUEUE_TIMEOUT, ADMISSION_RETRY_AFTER
+)
+
+READ_METHODS = {"GET", "HEAD"}
+# Only API routes hit MongoDB; probes, docs and /metrics are never queued
+ADMITTED_PREFIX = "/api/"
+# Long-lived streams served from memory would hold a slot for their lifetime
+UNLIMITED_PATHS = {"/api/allocations/stream"}
+
+
+class Rejected(Exception):
+    pass
+
+
+# A concurrency limit with a bounded FIFO wait queue. Requests over the
+# limit wait for a slot up to ADMISSION_QUEUE_TIMEOUT; when the queue is
+# already full they are rejected straight away.
+class AdmissionLimit:
+    def __init__(self, name, limit, queue_size, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.in_flight_gauge = ADMISSION_IN_FLIGHT.labels(name)
+        self.queue_gauge = ADMISSION_QUEUE_DEPTH.labels(name)
+        self.queue_wait = ADMISSION_QUEUE_WAIT.labels(name)
+        self.rejected = ADMISSION_REJECTED.labels(name)
+
+    async def acquire(self):
+        if self.semaphore.locked():
+            if self.waiting >= self.queue_size:
+                self.rejected.inc()
+                raise Rejected()
+            self.waiting += 1
+            self.queue_gauge.inc()
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self.rejected.inc()
+                raise Rejected()
+            finally:
+                self.waiting -= 1
+                self.queue_gauge.dec()
+                self.queue_wait.observe(time.perf_counter() - started)
+        else:
+            await self.semaphore.acquire()
+        self.in_flight_gauge.inc()
+
+    def release(self):
+        self.in_flight_gauge.dec()
+        self.semaphore.release()
+
+
+# Reads (history scans, exports) and writes get separate limits, so a burst
+# of one class cannot take every pooled connection from the other. The slot
+# is held until the response has been sent, streaming exports included.
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.limits = {
+            "read": AdmissionLimit("read", READ_CONCURRENCY, READ_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT),
+            "write": AdmissionLimit("write", WRITE_CONCURRENCY, WRITE_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not scope["path"].startswith(ADMITTED_PREFIX)
+                or scope["path"] in UNLIMITED_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits["read" if scope["method"] in READ_METHODS else "write"]
+        try:
+            await limit.acquire()
+        except Rejected:
+            await self._reject(send, limit.name)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
+
+    async def _reject(self, send, name):
+        body = json.dumps({"detail": f"Server busy: too many {name} requests, retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                [b"content-type", b"application/json"],
+                [b"content-length", str(len(body)).encode()],
+                [b"retry-after", str(ADMISSION_RETRY_AFTER).encode()],
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,84 @@
+import sys
+import asyncio
+import logging
+import argparse
+from datetime import datetime, date, timedelta
+from pymongo.errors import BulkWriteError
+from config import database, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLLECTION = "allocations_archive"
+
+
+# Allocations dated before this are moved to the archive. Past allocations
+# can no longer be updated or deleted, so archived rows never change again.
+def archive_horizon(days=ARCHIVE_AFTER_DAYS):
+    return datetime.combine(date.today() - timedelta(days=days), datetime.min.time())
+
+
+# Whether a history query starting at start_date can match archived rows
+def reaches_archive(start_date, days=ARCHIVE_AFTER_DAYS):
+    return start_date is None or datetime.combine(start_date, datetime.min.time()) < archive_horizon(days)
+
+
+async def archive_batch(horizon, batch_size=ARCHIVE_BATCH_SIZE):
+    # Copy first, delete second: a run that dies in between leaves copies
+    # that the next run skips as duplicate _ids before deleting the originals
+    documents = await database.allocations.find(
+        {"allocation_date": {"$lt": horizon}}
+    ).sort("allocation_date", 1).limit(batch_size).to_list(length=batch_size)
+    if not documents:
+        return 0
+    try:
+        await database[ARCHIVE_COLLECTION].insert_many(documents, ordered=False)
+    except BulkWriteError as bwe:
+        if any(error.get("code") != 11000 for error in bwe.details.get("writeErrors", [])):
+            raise
+    ids = [document["_id"] for document in documents]
+    # Mark the originals first: the change feed drops the deletes of marked
+    # allocations instead of announcing them to every subscriber
+    await database.allocations.update_many({"_id": {"$in": ids}}, {"$set": {"archived_at": datetime.utcnow()}})
+    result = await database.allocations.delete_many({"_id": {"$in": ids}})
+    return result.deleted_count
+
+
+async def archive_allocations(days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    horizon = archive_horizon(days)
+    archived = 0
+    while True:
+        moved = await archive_batch(horizon, batch_size)
+        if not moved:
+            break
+        archived += moved
+        # Let foreground requests in between batches
+        await asyncio.sleep(0)
+    if archived:
+        logger.info("Archived %d allocations dated before %s", archived, horizon.date())
+    return archived
+
+
+async def archive_forever():
+    # Optional in-app schedule (ARCHIVE_INTERVAL_SECONDS > 0)
+    while True:
+        try:
+            await archive_allocations()
+        except Exception as e:
+            logger.error("Archiving failed: %s", e)
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
+async def main(argv=None):
+    # The age comes from ARCHIVE_AFTER_DAYS only: history and export decide
+    # whether to read the archive from the same setting
+    parser = argparse.ArgumentParser(description="Move past allocations into the archive collection")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+    archived = await archive_allocations(batch_size=args.batch_size)
+    print(f"Archived {archived} allocations")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from datetime import date, datetime, timedelta
+
+# Allow running as a script from the project root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+from loadtest import Recorder, git_revision, percentile
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the pydantic and fast serialization paths of /allocations/history")
+    parser.add_argument("--page-sizes", default="10,50,100", help="Comma-separated history page sizes")
+    parser.add_argument("--iterations", type=int, default=2000, help="Pages serialized per size and path")
+    parser.add_argument("--requests", type=int, default=300, help="Full in-process requests per size and path (0 to skip)")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+# Aggregation output as HISTORY_PROJECTION returns it
+def history_documents(count):
+    now = datetime.utcnow()
+    today = datetime.combine(date.today(), datetime.min.time())
+    documents = []
+    for n in range(count):
+        _id = ObjectId()
+        documents.append({
+            "_id": _id,
+            "allocation_id": str(_id),
+            "employee_id": f"EMP{n:06d}",
+            "vehicle_id": f"VEH{n:06d}",
+            "driver_id": f"DRV{n:06d}",
+            "allocation_date": today + timedelta(days=n % 30),
+            "status": "active",
+            "created_at": now,
+            "updated_at": now,
+            "employee_name": f"Employee {n}",
+            "vehicle_name": f"Vehicle {n}",
+            "driver_name": f"Driver {n}"
+        })
+    return documents
+
+
+def history_route(router):
+    return next(route for route in router.routes if route.path == "/allocations/history")
+
+
+# The work each path does between the aggregation result and the response body
+async def pydantic_page(field, documents):
+    from fastapi.encoders import jsonable_encoder
+    from models.models import AllocationResponse
+    items = [AllocationResponse(**document) for document in documents]
+    cached = jsonable_encoder(items)
+    content = await serialize_response(field=field, response_content=items)
+    return JSONResponse(content).body, cached
+
+
+async def fast_page(field, documents):
+    from serialization import FastJSONResponse, allocation_json
+    items = [allocation_json(document) for document in documents]
+    return FastJSONResponse(items).body, items
+
+
+async def cpu_per_page(page, field, documents, iterations):
+    await page(field, documents)
+    started = time.process_time()
+    for _ in range(iterations):
+        await page(field, documents)
+    return (time.process_time() - started) / iterations
+
+
+async def request_latencies(app, size, requests):
+    # Each request uses a new skip value so every page misses the history cache
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for n in range(requests):
+            started = time.perf_counter()
+            response = await client.get("/api/allocations/history", params={"limit": size, "skip": n})
+            recorder.record("history", started, response.status_code)
+    values = sorted(recorder.latencies["history"])
+    return {
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3)
+    }
+
+
+async def run(args):
+    import config
+    from memorydb import MemoryClient
+    config.mongo.use(MemoryClient(), "vehicle_allocation_bench")
+    import routes.routes as routes
+    from cache import history_cache
+    from main import app
+
+    sizes = [int(size) for size in args.page_sizes.split(",")]
+    field = history_route(routes.router).response_field
+    if args.requests:
+        await config.database.allocations.insert_many(history_documents(max(sizes) + args.requests))
+
+    results = {}
+    for size in sizes:
+        documents = history_documents(size)
+        pydantic_body, _ = await pydantic_page(field, documents)
+        fast_body, _ = await fast_page(field, documents)
+        pydantic_cpu = await cpu_per_page(pydantic_page, field, documents, args.iterations)
+        fast_cpu = await cpu_per_page(fast_page, field, documents, args.iterations)
+        result = {
+            "identical_body": pydantic_body == fast_body,
+            "pydantic_cpu_us_per_page": round(pydantic_cpu * 1e6, 1),
+            "fast_cpu_us_per_page": round(fast_cpu * 1e6, 1),
+            "cpu_saving_pct": round((1 - fast_cpu / pydantic_cpu) * 100, 1)
+        }
+        if args.requests:
+            for mode, label in ((False, "pydantic_request"), (True, "fast_request")):
+                routes.FAST_SERIALIZATION = mode
+                await history_cache.invalidate(everything=True)
+                result[label] = await request_latencies(app, size, args.requests)
+        results[str(size)] = result
+
+    from serialization import orjson
+    return {
+        "git_revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "encoder": "orjson" if orjson is not None else "json",
+        "config": {"iterations": args.iterations, "requests": args.requests},
+        "page_sizes": results
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
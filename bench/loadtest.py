@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from datetime import date, datetime, timedelta
+
+# Allow running as a script from the project root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+
+ENDPOINTS = ("create", "update", "delete", "history")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the vehicle allocation API")
+    parser.add_argument("--mongodb-url", help="Benchmark against this MongoDB instead of the in-memory stand-in")
+    parser.add_argument("--database", default="vehicle_allocation_bench", help="Database to seed and use (it is wiped)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated round trip per call on the in-memory database")
+    parser.add_argument("--employees", type=int, default=1000)
+    parser.add_argument("--vehicles", type=int, default=500)
+    parser.add_argument("--allocations", type=int, default=5000, help="Allocations seeded before the run")
+    parser.add_argument("--horizon-days", type=int, default=60, help="Future days allocations are spread over")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=5000, help="Total requests across all clients")
+    parser.add_argument("--mix", default="create=40,update=20,delete=10,history=30", help="Relative weight of each endpoint")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint in --mix: {name}")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def connect(args):
+    import config
+    if args.mongodb_url:
+        config.mongo.url = args.mongodb_url
+        config.mongo.database_name = args.database
+    else:
+        from memorydb import MemoryClient
+        config.mongo.use(MemoryClient(latency=args.latency_ms / 1000), args.database)
+    return config.database
+
+
+def employee_id(number):
+    return f"EMP{number:06d}"
+
+
+def vehicle_id(number):
+    return f"VEH{number:06d}"
+
+
+async def seed(database, args):
+    for name in ("employees", "vehicles", "drivers", "allocations"):
+        await database[name].delete_many({})
+
+    await database.employees.insert_many([
+        {"employee_id": employee_id(n), "name": f"Employee {n}", "department": "Operations"}
+        for n in range(args.employees)
+    ])
+    await database.vehicles.insert_many([
+        {"vehicle_id": vehicle_id(n), "vehicle_name": f"Vehicle {n}", "driver_id": f"DRV{n:06d}", "status": "available"}
+        for n in range(args.vehicles)
+    ])
+    await database.drivers.insert_many([
+        {"driver_id": f"DRV{n:06d}", "name": f"Driver {n}", "assigned_vehicle_id": vehicle_id(n)}
+        for n in range(args.vehicles)
+    ])
+
+    # Distinct (vehicle, day) slots so the seed respects the unique index
+    rng = random.Random(args.seed)
+    slots = args.vehicles * args.horizon_days
+    count = min(args.allocations, slots)
+    today = datetime.combine(date.today(), datetime.min.time())
+    now = datetime.utcnow()
+    batch = []
+    for slot in rng.sample(range(slots), count):
+        vehicle, day = divmod(slot, args.horizon_days)
+        employee = rng.randrange(args.employees)
+        batch.append({
+            "employee_id": employee_id(employee),
+            "vehicle_id": vehicle_id(vehicle),
+            "driver_id": f"DRV{vehicle:06d}",
+            "allocation_date": today + timedelta(days=day + 1),
+            "status": "active",
+            "created_at": now,
+            "updated_at": now,
+            "employee_name": f"Employee {employee}",
+            "vehicle_name": f"Vehicle {vehicle}",
+            "driver_name": f"Driver {vehicle}"
+        })
+        if len(batch) == 1000:
+            await database.allocations.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await database.allocations.insert_many(batch, ordered=False)
+
+    documents = await database.allocations.find({}, {"_id": 1}).to_list(length=None)
+    return [str(document["_id"]) for document in documents]
+
+
+# Drive the ASGI lifespan so startup work (indexes, occupancy index) runs as in production
+class Lifespan:
+    def __init__(self, app):
+        self.app = app
+        self.events = asyncio.Queue()
+        self.started = asyncio.Event()
+        self.stopped = asyncio.Event()
+
+    async def receive(self):
+        return await self.events.get()
+
+    async def send(self, message):
+        if message["type"].startswith("lifespan.startup"):
+            self.started.set()
+        elif message["type"].startswith("lifespan.shutdown"):
+            self.stopped.set()
+        if message["type"].endswith(".failed"):
+            raise RuntimeError(message.get("message"))
+
+    async def __aenter__(self):
+        self.task = asyncio.create_task(self.app({"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}, self.receive, self.send))
+        await self.events.put({"type": "lifespan.startup"})
+        await self.started.wait()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.events.put({"type": "lifespan.shutdown"})
+        await self.stopped.wait()
+        await self.task
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {name: [] for name in ENDPOINTS}
+        self.statuses = {name: {} for name in ENDPOINTS}
+
+    def record(self, name, started, status):
+        self.latencies[name].append(time.perf_counter() - started)
+        self.statuses[name][status] = self.statuses[name].get(status, 0) + 1
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(values, statuses, elapsed):
+    values = sorted(values)
+    to_ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        "requests": len(values),
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else None,
+        "errors": sum(count for status, count in statuses.items() if status >= 500),
+        "status_codes": {str(status): count for status, count in sorted(statuses.items())},
+        "mean_ms": to_ms(sum(values) / len(values)) if values else None,
+        "p50_ms": to_ms(percentile(values, 0.50)),
+        "p95_ms": to_ms(percentile(values, 0.95)),
+        "p99_ms": to_ms(percentile(values, 0.99)),
+        "max_ms": to_ms(values[-1]) if values else None
+    }
+
+
+async def client_loop(client, worker, args, weights, pool, budget, recorder):
+    rng = random.Random(args.seed * 1000 + worker)
+    names = list(weights)
+    relative = [weights[name] for name in names]
+    while budget[0] > 0:
+        budget[0] -= 1
+        name = rng.choices(names, weights=relative)[0]
+        if name in ("update", "delete") and not pool:
+            name = "create"
+        day = (date.today() + timedelta(days=rng.randint(1, args.horizon_days))).isoformat()
+
+        started = time.perf_counter()
+        if name == "create":
+            response = await client.post("/api/allocations", json={
+                "employee_id": employee_id(rng.randrange(args.employees)),
+                "vehicle_id": vehicle_id(rng.randrange(args.vehicles)),
+                "allocation_date": day
+            })
+            if response.status_code == 200:
+                pool.append(response.json()["allocation_id"])
+        elif name == "update":
+            allocation_id = pool[rng.randrange(len(pool))]
+            body = {"status": rng.choice(["active", "cancelled"])} if rng.random() < 0.5 else {"allocation_date": day}
+            response = await client.put(f"/api/allocations/{allocation_id}", json=body)
+        elif name == "delete":
+            allocation_id = pool.pop(rng.randrange(len(pool)))
+            response = await client.delete(f"/api/allocations/{allocation_id}")
+        else:
+            params = {"limit": rng.choice([10, 50])}
+            shape = rng.random()
+            if shape < 0.4:
+                params["employee_id"] = employee_id(rng.randrange(args.employees))
+            elif shape < 0.8:
+                params["vehicle_id"] = vehicle_id(rng.randrange(args.vehicles))
+            response = await client.get("/api/allocations/history", params=params)
+        recorder.record(name, started, response.status_code)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+async def run(args):
+    weights = parse_mix(args.mix)
+    database = connect(args)
+    pool = await seed(database, args)
+    random.Random(args.seed).shuffle(pool)
+
+    from main import app
+
+    recorder = Recorder()
+    budget = [args.requests]
+    transport = httpx.ASGITransport(app=app)
+    async with Lifespan(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            while (await client.get("/ready")).status_code != 200:
+                await asyncio.sleep(0.05)
+            started = time.perf_counter()
+            await asyncio.gather(*[
+                client_loop(client, worker, args, weights, pool, budget, recorder)
+                for worker in range(args.concurrency)
+            ])
+            elapsed = time.perf_counter() - started
+
+    all_latencies = [value for values in recorder.latencies.values() for value in values]
+    all_statuses = {}
+    for statuses in recorder.statuses.values():
+        for status, count in statuses.items():
+            all_statuses[status] = all_statuses.get(status, 0) + count
+
+    return {
+        "git_revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "backend": "mongodb" if args.mongodb_url else "memory",
+        "config": {
+            "employees": args.employees, "vehicles": args.vehicles, "allocations": args.allocations,
+            "horizon_days": args.horizon_days, "concurrency": args.concurrency, "requests": args.requests,
+            "mix": weights, "seed": args.seed, "latency_ms": args.latency_ms
+        },
+        "elapsed_s": round(elapsed, 3),
+        "total": summarize(all_latencies, all_statuses, elapsed),
+        "endpoints": {
+            name: summarize(recorder.latencies[name], recorder.statuses[name], elapsed)
+            for name in ENDPOINTS if recorder.latencies[name]
+        }
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from redis.exceptions import RedisError
+from config import (
+    database, redis_client, REFERENCE_CACHE_TTL, LOCAL_CACHE_TTL, LOCAL_CACHE_SIZE,
+    HISTORY_CACHE_TTL, HISTORY_CACHE_SIZE, MEMORY_STORE_SIZE
+)
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+
+# In-process LRU cache with a per-entry TTL
+class LRUCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# In-memory stand-in for the subset of the redis.asyncio API used by the caches.
+# Expired keys are purged every PURGE_INTERVAL writes; past maxsize the
+# oldest keys with a TTL are evicted. Keys without one (the history cache
+# generations) are never evicted: losing one would revive stale pages.
+class MemoryRedis:
+    PURGE_INTERVAL = 1000
+
+    def __init__(self, maxsize=MEMORY_STORE_SIZE):
+        self.maxsize = maxsize
+        self._data = {}
+        self._writes = 0
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def _written(self):
+        self._writes += 1
+        if self._writes % self.PURGE_INTERVAL and len(self._data) <= self.maxsize:
+            return
+        now = time.monotonic()
+        expired = [key for key, (_, expires_at) in self._data.items() if expires_at is not None and expires_at < now]
+        for key in expired:
+            del self._data[key]
+        # Evict down to 90% so the next eviction is PURGE_INTERVAL-ish writes away
+        excess = len(self._data) - int(self.maxsize * 0.9) if len(self._data) > self.maxsize else 0
+        if excess > 0:
+            evicted = [key for key, (_, expires_at) in self._data.items() if expires_at is not None][:excess]
+            for key in evicted:
+                del self._data[key]
+
+    async def get(self, name):
+        entry = self._live(name)
+        return entry[0] if entry else None
+
+    async def mget(self, keys):
+        return [await self.get(key) for key in keys]
+
+    async def set(self, name, value, ex=None, nx=False):
+        if nx and self._live(name):
+            return None
+        # Re-inserted at the end, so eviction goes oldest write first
+        self._data.pop(name, None)
+        self._data[name] = (str(value), time.monotonic() + ex if ex else None)
+        self._written()
+        return True
+
+    async def delete(self, *names):
+        return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    async def incr(self, name, amount=1):
+        entry = self._live(name)
+        value = int(entry[0]) + amount if entry else amount
+        self._data[name] = (str(value), entry[1] if entry else None)
+        self._written()
+        return value
+
+
+shared_store = redis_client if redis_client is not None else MemoryRedis()
+
+
+# Read-through cache: in-process LRU -> Redis -> MongoDB
+class ReferenceCache:
+    def __init__(self, collection_name, key_field, fields):
+        self.collection_name = collection_name
+        self.key_field = key_field
+        self.projection = {"_id": 0, **{field: 1 for field in fields}}
+        self.local = LRUCache(LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL)
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _redis_key(self, key):
+        return f"ref:{self.collection_name}:{key}"
+
+    async def get(self, key):
+        found = await self.get_many([key])
+        return found.get(key)
+
+    async def get_many(self, keys):
+        found = {}
+        pending = []
+        for key in dict.fromkeys(keys):
+            value = self.local.get(key)
+            if value is not None:
+                found[key] = value
+                self.local_hits += 1
+            else:
+                pending.append(key)
+        if not pending:
+            return found
+
+        try:
+            cached = await shared_store.mget([self._redis_key(key) for key in pending])
+        except (RedisError, OSError) as e:
+            # A cache outage must not take the API down with it
+            logger.warning("Redis read failed for %s: %s", self.collection_name, e)
+            self.errors += 1
+            cached = [None] * len(pending)
+
+        missing = []
+        for key, raw in zip(pending, cached):
+            if raw is None:
+                missing.append(key)
+                continue
+            value = json.loads(raw)
+            self.local.set(key, value)
+            found[key] = value
+            self.redis_hits += 1
+        if not missing:
+            return found
+
+        # Load everything still missing with a single query
+        self.misses += len(missing)
+        collection = database[self.collection_name]
+        documents = await collection.find(
+            {self.key_field: {"$in": missing}}, self.projection
+        ).to_list(length=None)
+        for document in documents:
+            key = document[self.key_field]
+            self.local.set(key, document)
+            found[key] = document
+            try:
+                await shared_store.set(self._redis_key(key), json.dumps(document, default=str), ex=REFERENCE_CACHE_TTL)
+            except (RedisError, OSError) as e:
+                logger.warning("Redis write failed for %s: %s", self.collection_name, e)
+                self.errors += 1
+        return found
+
+    async def invalidate(self, *keys):
+        for key in keys:
+            self.local.delete(key)
+        try:
+            await shared_store.delete(*[self._redis_key(key) for key in keys])
+        except (RedisError, OSError) as e:
+            logger.warning("Redis invalidation failed for %s: %s", self.collection_name, e)
+            self.errors += 1
+
+    def stats(self):
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "local_size": len(self.local)
+        }
+
+
+employee_cache = ReferenceCache("employees", "employee_id", ["employee_id", "name"])
+vehicle_cache = ReferenceCache("vehicles", "vehicle_id", ["vehicle_id", "vehicle_name", "status"])
+# Drivers are looked up by the vehicle they are assigned to
+driver_cache = ReferenceCache("drivers", "assigned_vehicle_id", ["driver_id", "name", "assigned_vehicle_id"])
+
+
+# Cache of serialized history pages. Every key embeds the generation
+# counters of the scopes the query depends on, so bumping a counter makes
+# the affected pages unreachable without touching any other page.
+class HistoryCache:
+    def __init__(self):
+        self.local = LRUCache(HISTORY_CACHE_SIZE, HISTORY_CACHE_TTL)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    @staticmethod
+    def _scopes(params):
+        # "epoch" covers changes that can touch any page (e.g. driver renames);
+        # "all" covers pages that are not narrowed to an employee or vehicle
+        scopes = ["epoch"]
+        if params.get("employee_id"):
+            scopes.append(f"employee:{params['employee_id']}")
+        if params.get("vehicle_id"):
+            scopes.append(f"vehicle:{params['vehicle_id']}")
+        if len(scopes) == 1:
+            scopes.append("all")
+        return scopes
+
+    async def _key(self, params):
+        scopes = self._scopes(params)
+        generations = await shared_store.mget([f"hist:gen:{scope}" for scope in scopes])
+        normalized = json.dumps(params, sort_keys=True, default=str)
+        digest = hashlib.sha1(normalized.encode()).hexdigest()
+        versions = ".".join(generation or "0" for generation in generations)
+        return f"hist:page:{versions}:{digest}"
+
+    async def get(self, params):
+        try:
+            key = await self._key(params)
+            page = self.local.get(key)
+            if page is None and not isinstance(shared_store, MemoryRedis):
+                raw = await shared_store.get(key)
+                if raw is not None:
+                    page = json.loads(raw)
+                    self.local.set(key, page)
+        except (RedisError, OSError) as e:
+            logger.warning("History cache read failed: %s", e)
+            self.errors += 1
+            return None, None
+        if page is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key, page
+
+    async def set(self, key, page):
+        if key is None:
+            return
+        self.local.set(key, page)
+        # Without Redis the LRU is the only copy worth keeping
+        if isinstance(shared_store, MemoryRedis):
+            return
+        try:
+            await shared_store.set(key, dumps(page).decode(), ex=HISTORY_CACHE_TTL)
+        except (RedisError, OSError) as e:
+            logger.warning("History cache write failed: %s", e)
+            self.errors += 1
+
+    async def invalidate(self, employee_ids=(), vehicle_ids=(), everything=False):
+        scopes = ["epoch"] if everything else ["all"]
+        scopes += [f"employee:{employee_id}" for employee_id in set(employee_ids)]
+        scopes += [f"vehicle:{vehicle_id}" for vehicle_id in set(vehicle_ids)]
+        self.invalidations += 1
+        try:
+            await asyncio.gather(*[shared_store.incr(f"hist:gen:{scope}") for scope in scopes])
+        except (RedisError, OSError) as e:
+            # Fall back to dropping this process' pages; others expire by TTL
+            logger.warning("History cache invalidation failed: %s", e)
+            self.errors += 1
+            self.local.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+            "local_size": len(self.local)
+        }
+
+
+history_cache = HistoryCache()
+
+
+def cache_stats():
+    return {
+        "backend": "redis" if redis_client is not None else "memory",
+        "employees": employee_cache.stats(),
+        "vehicles": vehicle_cache.stats(),
+        "drivers": driver_cache.stats(),
+        "history": history_cache.stats()
+    }
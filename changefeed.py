@@ -0,0 +1,244 @@
+import re
+import json
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from itertools import count
+from pymongo.errors import OperationFailure, PyMongoError
+from redis.exceptions import RedisError
+from config import (
+    database, redis_client, CHANGE_FEED_MODE, CHANGE_FEED_BUFFER_SIZE, CHANGE_FEED_QUEUE_SIZE, ARCHIVE_BATCH_SIZE
+)
+from serialization import allocation_json, dumps
+
+logger = logging.getLogger(__name__)
+
+# Local events are relayed through Redis so every worker sees every write
+RELAY_CHANNEL = "changefeed:allocations"
+# Ids of events recorded by the write routes; anything else is a resume token
+LOCAL_EVENT_ID = re.compile(r"^[0-9a-f]{8}-[0-9]+$")
+
+
+def allocation_event(operation, document, allocation_id=None):
+    # document is None for deletes the change stream has no pre-image for
+    event = {
+        "operation": operation,
+        "allocation_id": str(document["_id"]) if document else allocation_id,
+        "employee_id": document.get("employee_id") if document else None,
+        "vehicle_id": document.get("vehicle_id") if document else None,
+        "allocation": None
+    }
+    if document and operation != "delete":
+        event["allocation"] = allocation_json({**document, "allocation_id": event["allocation_id"]})
+    return event
+
+
+class Subscriber:
+    def __init__(self, employee_id=None, vehicle_id=None):
+        self.employee_id = employee_id
+        self.vehicle_id = vehicle_id
+        self.queue = asyncio.Queue(maxsize=CHANGE_FEED_QUEUE_SIZE)
+        self.overflowed = False
+
+    def matches(self, event):
+        # Events without ids (deletes without a pre-image) go to everyone
+        if self.employee_id and event["employee_id"] and event["employee_id"] != self.employee_id:
+            return False
+        if self.vehicle_id and event["vehicle_id"] and event["vehicle_id"] != self.vehicle_id:
+            return False
+        return True
+
+
+# Fans allocation changes out to every subscriber from a single source: one
+# MongoDB change stream when the deployment supports it, otherwise the write
+# routes (relayed between workers through Redis when REDIS_URL is set). Recent events are kept in a ring buffer so clients
+# can resume from their last event id; a subscriber whose queue fills up is
+# cut off (and resumes from the buffer) instead of slowing the feed down.
+class ChangeFeed:
+    def __init__(self):
+        self.subscribers = set()
+        self.buffer = deque(maxlen=CHANGE_FEED_BUFFER_SIZE)
+        self.mode = None
+        # Allocations marked by the archive job, whose deletes are not real deletes
+        self.archiving = OrderedDict()
+        self._sequence = count(1)
+        # Local event ids are only meaningful to this process run
+        self._epoch = uuid.uuid4().hex[:8]
+        # Events waiting for the relay, published one at a time in write order
+        self._outbox = None
+        self._relay_task = None
+
+    def subscribe(self, employee_id=None, vehicle_id=None, last_event_id=None):
+        # Returns the subscriber and the buffered events it missed, or None
+        # for the backlog when last_event_id is no longer in the buffer
+        subscriber = Subscriber(employee_id, vehicle_id)
+        backlog = []
+        if last_event_id:
+            ids = [event_id for event_id, _ in self.buffer]
+            if last_event_id not in ids:
+                backlog = None
+            else:
+                missed = list(self.buffer)[ids.index(last_event_id) + 1:]
+                backlog = [(event_id, event) for event_id, event in missed if subscriber.matches(event)]
+        self.subscribers.add(subscriber)
+        return subscriber, backlog
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event_id, event):
+        self.buffer.append((event_id, event))
+        for subscriber in list(self.subscribers):
+            if not subscriber.matches(event):
+                continue
+            try:
+                subscriber.queue.put_nowait((event_id, event))
+            except asyncio.QueueFull:
+                subscriber.overflowed = True
+                self.subscribers.discard(subscriber)
+
+    def record(self, before, after):
+        # Called by the write routes; only used when there is no change stream
+        if self.mode != "local":
+            return
+        if before is None:
+            event = allocation_event("insert", after)
+        elif after is None:
+            event = allocation_event("delete", before)
+        else:
+            event = allocation_event("update", after)
+        event_id = f"{self._epoch}-{next(self._sequence)}"
+        if redis_client is None:
+            self.publish(event_id, event)
+        else:
+            # Every worker, this one included, publishes it from the relay
+            self._outbox.put_nowait((event_id, event))
+
+    async def _relay(self):
+        while True:
+            event_id, event = await self._outbox.get()
+            try:
+                await redis_client.publish(RELAY_CHANNEL, dumps({"id": event_id, "event": event}).decode())
+            except (RedisError, OSError) as e:
+                logger.warning("Change feed relay publish failed: %s", e)
+                self.publish(event_id, event)
+
+    async def follow_relay(self):
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(RELAY_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        relayed = json.loads(message["data"])
+                        self.publish(relayed["id"], relayed["event"])
+            except (RedisError, OSError) as e:
+                logger.error("Change feed relay interrupted, resubscribing: %s", e)
+            finally:
+                await pubsub.aclose()
+            await asyncio.sleep(1)
+
+    async def run(self):
+        # Decide the source once, then follow the change stream for good
+        if CHANGE_FEED_MODE == "local":
+            self.mode = "local"
+            await self._run_local()
+            return
+        resume_token = None
+        while True:
+            try:
+                async with database.allocations.watch(
+                    full_document="updateLookup",
+                    full_document_before_change="whenAvailable",
+                    resume_after=resume_token
+                ) as stream:
+                    self.mode = "change_stream"
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._publish_change(change)
+            except OperationFailure as e:
+                if self.mode is None and CHANGE_FEED_MODE == "auto":
+                    logger.warning("Change streams unavailable (%s); feeding the change feed from this process", e)
+                    self.mode = "local"
+                    await self._run_local()
+                    return
+                # The token may have fallen off the oplog; start from now
+                logger.error("Change stream failed, reopening: %s", e)
+                resume_token = None
+            except PyMongoError as e:
+                logger.error("Change stream interrupted, resuming: %s", e)
+            await asyncio.sleep(1)
+
+    async def _run_local(self):
+        if redis_client is not None:
+            # Set up before the first await, so record() always finds the outbox
+            self._outbox = asyncio.Queue()
+            self._relay_task = asyncio.create_task(self._relay())
+            try:
+                await self.follow_relay()
+            finally:
+                self._relay_task.cancel()
+
+    def _archiving(self, change, archiving):
+        # Archive batches mark their allocations before deleting them
+        operation = change["operationType"]
+        document_id = change.get("documentKey", {}).get("_id")
+        if operation == "update" and "archived_at" in change.get("updateDescription", {}).get("updatedFields", {}):
+            archiving[document_id] = True
+            while len(archiving) > 10 * ARCHIVE_BATCH_SIZE:
+                archiving.popitem(last=False)
+            return True
+        if operation == "delete":
+            before = change.get("fullDocumentBeforeChange") or {}
+            return archiving.pop(document_id, None) is not None or "archived_at" in before
+        return False
+
+    def _change_event(self, change, archiving):
+        if self._archiving(change, archiving):
+            return None
+        operation = change["operationType"]
+        if operation in ("insert", "update", "replace"):
+            document = change.get("fullDocument")
+            if document is None:
+                # Deleted again before the update could be looked up
+                return None
+            event = allocation_event("insert" if operation == "insert" else "update", document)
+        elif operation == "delete":
+            event = allocation_event(
+                "delete", change.get("fullDocumentBeforeChange"), str(change["documentKey"]["_id"])
+            )
+        else:
+            return None
+        # The resume token doubles as the event id, so clients can resume
+        # from it on any worker and after restarts (see replay)
+        return change["_id"]["_data"], event
+
+    def _publish_change(self, change):
+        change_event = self._change_event(change, self.archiving)
+        if change_event is not None:
+            self.publish(*change_event)
+
+    def can_replay(self, event_id):
+        return self.mode == "change_stream" and bool(event_id) and not LOCAL_EVENT_ID.match(event_id)
+
+    async def replay(self, subscriber, resume_token):
+        # Catch a subscriber up from a token that is no longer in the buffer
+        # with its own change stream, until it has nothing more to return;
+        # raises PyMongoError when the token has fallen off the oplog
+        archiving = OrderedDict()
+        async with database.allocations.watch(
+            full_document="updateLookup",
+            full_document_before_change="whenAvailable",
+            resume_after={"_data": resume_token}
+        ) as stream:
+            while True:
+                change = await stream.try_next()
+                if change is None:
+                    return
+                change_event = self._change_event(change, archiving)
+                if change_event is not None and subscriber.matches(change_event[1]):
+                    yield change_event
+
+
+change_feed = ChangeFeed()
@@ -1,33 +1,108 @@
 
 import os
-from pymongo import MongoClient
+import logging
 from pymongo.server_api import ServerApi
-from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
+import redis.asyncio as redis
+from monitoring import QueryMonitor
+from metrics import PoolMetricsListener, observe_command
+from mongo import MongoConnection
 
 load_dotenv()
 
-# MongoDB connection
-MONGODB_URL = os.getenv("MONGODB_URL")  
-print(MONGODB_URL)
-client = AsyncIOMotorClient(MONGODB_URL, server_api=ServerApi('1'))
-database = client.vehicle_allocation
-
-# Create indexes for optimization
-async def create_indexes():
-    await database.vehicles.create_index("vehicle_id", unique=True)
-    await database.drivers.create_index("driver_id", unique=True)
-    await database.employees.create_index("employee_id", unique=True)
-    # Compound index for allocation checks
-    await database.allocations.create_index([
-        ("vehicle_id", 1),
-        ("allocation_date", 1)
-    ], unique=True)
-    # Index for history reports
-    await database.allocations.create_index([
-        ("allocation_date", -1),
-        ("employee_id", 1)
-    ])
+# Slow query log: commands slower than SLOW_QUERY_MS are logged with their
+# shape (values redacted) and, if SLOW_QUERY_EXPLAIN is set, their plan
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "").lower() in ("1", "true", "yes")
+SLOW_QUERY_LOG_FILE = os.getenv("SLOW_QUERY_LOG_FILE")
+query_monitor = QueryMonitor(SLOW_QUERY_MS, SLOW_QUERY_LOG_SIZE, SLOW_QUERY_EXPLAIN)
+query_monitor.observers.append(observe_command)
+if SLOW_QUERY_LOG_FILE:
+    logging.getLogger("slow_queries").addHandler(logging.FileHandler(SLOW_QUERY_LOG_FILE))
 
+# MongoDB connection. The client is created and pre-warmed by the app
+# lifespan (see main.py); scripts connect lazily on first use.
+MONGODB_URL = os.getenv("MONGODB_URL")
+MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "vehicle_allocation")
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "10"))
+# Comma-separated, in order of preference: zstd and snappy need the
+# zstandard / python-snappy packages, zlib is always available
+MONGODB_COMPRESSORS = os.getenv("MONGODB_COMPRESSORS", "zlib")
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "30000"))
+# How long a request waits for a free pooled connection before failing
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+# Delay between pool warm-up attempts while MongoDB is unreachable at startup
+MONGODB_WARMUP_RETRY_SECONDS = float(os.getenv("MONGODB_WARMUP_RETRY_SECONDS", "5"))
 
+mongo = MongoConnection(
+    MONGODB_URL,
+    MONGODB_DATABASE,
+    server_api=ServerApi('1'),
+    event_listeners=[query_monitor, PoolMetricsListener()],
+    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+    minPoolSize=MONGODB_MIN_POOL_SIZE,
+    compressors=MONGODB_COMPRESSORS,
+    connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+    socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+    waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+)
+database = mongo.database
 
+# Redis connection (optional); without it the caches fall back to an in-memory store
+REDIS_URL = os.getenv("REDIS_URL")
+redis_client = redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+# Keys the in-memory fallback store may hold; expiring keys are evicted past it
+MEMORY_STORE_SIZE = int(os.getenv("MEMORY_STORE_SIZE", "100000"))
+
+# Reference data cache settings (seconds / entries)
+REFERENCE_CACHE_TTL = int(os.getenv("REFERENCE_CACHE_TTL", "300"))
+LOCAL_CACHE_TTL = int(os.getenv("LOCAL_CACHE_TTL", "30"))
+LOCAL_CACHE_SIZE = int(os.getenv("LOCAL_CACHE_SIZE", "10000"))
+
+# History page cache settings (seconds / entries)
+HISTORY_CACHE_TTL = int(os.getenv("HISTORY_CACHE_TTL", "60"))
+HISTORY_CACHE_SIZE = int(os.getenv("HISTORY_CACHE_SIZE", "5000"))
+
+# Admission control: concurrent API requests per route class (reads are
+# GET/HEAD, everything else is a write), how many more may queue, and how
+# long they wait before a 503. By default the two limits split the pool so
+# history scans cannot take the connections allocation writes need.
+WRITE_CONCURRENCY = int(os.getenv("WRITE_CONCURRENCY", str(max(1, MONGODB_MAX_POOL_SIZE * 2 // 5))))
+READ_CONCURRENCY = int(os.getenv("READ_CONCURRENCY", str(max(1, MONGODB_MAX_POOL_SIZE - WRITE_CONCURRENCY))))
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", "200"))
+READ_QUEUE_SIZE = int(os.getenv("READ_QUEUE_SIZE", "200"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+# Seconds sent in Retry-After when a request is shed
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+# Idempotency-Key responses are kept this long (seconds); the lock that
+# coalesces concurrent duplicates expires after IDEMPOTENCY_LOCK_TTL
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_LOCK_TTL = int(os.getenv("IDEMPOTENCY_LOCK_TTL", "30"))
+
+# Allocation change feed: "auto" follows a MongoDB change stream when the
+# deployment has one (replica set or sharded cluster) and otherwise publishes
+# this process's own writes; "local" forces the latter. The buffer holds the
+# events clients can resume from, the queue bounds each subscriber.
+CHANGE_FEED_MODE = os.getenv("CHANGE_FEED_MODE", "auto")
+CHANGE_FEED_BUFFER_SIZE = int(os.getenv("CHANGE_FEED_BUFFER_SIZE", "1000"))
+CHANGE_FEED_QUEUE_SIZE = int(os.getenv("CHANGE_FEED_QUEUE_SIZE", "100"))
+CHANGE_FEED_KEEPALIVE_SECONDS = float(os.getenv("CHANGE_FEED_KEEPALIVE_SECONDS", "15"))
+
+# Allocations older than ARCHIVE_AFTER_DAYS move to allocations_archive
+# (python archive.py, or every ARCHIVE_INTERVAL_SECONDS in the app when > 0)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "0"))
+
+# Encode allocation responses straight to JSON (orjson when installed),
+# skipping the response_model re-validation; set to 0 for the pydantic path
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "1").lower() in ("1", "true", "yes")
+
+# How often the in-process vehicle occupancy index is rebuilt (seconds)
+OCCUPANCY_REFRESH_SECONDS = int(os.getenv("OCCUPANCY_REFRESH_SECONDS", "60"))
@@ -1,146 +1,274 @@
 import os
+import sys
+import time
+import random
 import logging
-from motor.motor_asyncio import AsyncIOMotorClient
-from dotenv import load_dotenv
+import argparse
+from math import gcd
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from multiprocessing import Pool
 from faker import Faker
+from faker.providers.person.en_US import Provider as PersonProvider
+from faker.providers.company.en_US import Provider as CompanyProvider
+from faker.providers.lorem.en_US import Provider as LoremProvider
+from pymongo import MongoClient, IndexModel
 from pymongo.errors import BulkWriteError
 
+# Allow running as a script from anywhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import MONGODB_URL, MONGODB_DATABASE
+from indexes import INDEX_SPECS, INDEX_OPTIONS
+
 # Set up logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
 
-# Load environment variables
-load_dotenv()
+DEPARTMENTS = ("Engineering", "Marketing", "Finance", "Sales", "Operations", "Legal", "Human Resources", "Customer Support")
+VEHICLE_STATUSES = OrderedDict([("available", 0.85), ("maintenance", 0.10), ("retired", 0.05)])
+FIRST_NAMES = list(PersonProvider.first_names)
+LAST_NAMES = list(PersonProvider.last_names)
+COMPANY_SUFFIXES = list(CompanyProvider.company_suffixes)
+WORDS = list(LoremProvider.word_list)
 
-# MongoDB connection
-MONGODB_URL = os.getenv("MONGODB_URL")
-client = AsyncIOMotorClient(MONGODB_URL)
+# Collections in load order
+ENTITIES = ("employees", "drivers", "vehicles", "allocations")
 
-# Check if the connection is successful
-async def check_connection():
-    try:
-        # Attempt to get a list of databases
-        await client.admin.command('ping')
-        logging.info("Connected to MongoDB successfully!")
-    except Exception as e:
-        logging.error("Failed to connect to MongoDB:", e)
-
-database = client['vehicle_allocation']  # Database name
-
-# Collections
-employees_collection = database['employees']
-vehicles_collection = database['vehicles']
-drivers_collection = database['drivers']
-
-# Initialize Faker
-fake = Faker()
-
-# Define the number of records you want to generate
-NUM_EMPLOYEES = 1000
-NUM_VEHICLES = 1000
-NUM_DRIVERS = 1000
-
-# Generate fake Employees
-def generate_fake_employees(num_employees):
-    employees = []
-    existing_ids = set()  # Track existing IDs to avoid duplicates
-    while len(employees) < num_employees:
-        employee_id = fake.unique.bothify(text="EMP####")
-        if employee_id not in existing_ids:  # Check for uniqueness
-            employee = {
-                "employee_id": employee_id,
-                "name": fake.name(),
-                "department": fake.random_element(elements=("Engineering", "Marketing", "Finance", "Sales", "Operations", "Legal", "Human Resources", "Customer Support")),
-                "contact_number": fake.phone_number()
-            }
-            employees.append(employee)
-            existing_ids.add(employee_id)  # Add the ID to the set
-    return employees
-
-# Generate fake Vehicles
-def generate_fake_vehicles(num_vehicles, drivers):
-    vehicles = []
-    for i in range(num_vehicles):
-        vehicle = {
-            "vehicle_id": fake.unique.bothify(text="VEH#####"),
-            "vehicle_name": fake.company() + " " + fake.word().capitalize(),
-            "driver_id": drivers[i]["driver_id"],
-            "status": fake.random_element(elements=("available", "maintenance", "retired"))
+
+# IDs come from the entity number, so they are unique without fake.unique
+# and any process can derive them
+def employee_id(number):
+    return f"EMP{number + 1:07d}"
+
+
+def vehicle_id(number):
+    return f"VEH{number + 1:06d}"
+
+
+def driver_id(number):
+    return f"DRV{number + 1:06d}"
+
+
+# Names are a pure function of (seed, kind, number) so allocation batches
+# can denormalize them without looking anything up
+def _rng(seed, kind, number):
+    return random.Random(f"{seed}:{kind}:{number}")
+
+
+def person_name(seed, kind, number):
+    rng = _rng(seed, kind, number)
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def vehicle_name(seed, number):
+    rng = _rng(seed, "vehicle", number)
+    return f"{rng.choice(LAST_NAMES)} {rng.choice(COMPANY_SUFFIXES)} {rng.choice(WORDS).capitalize()}"
+
+
+def _faker(seed, kind, start):
+    # One Faker per batch, seeded by position, so output does not depend on worker count
+    fake = Faker()
+    fake.seed_instance(f"{seed}:{kind}:{start}")
+    return fake
+
+
+def generate_employees(plan, start, end):
+    fake = _faker(plan["seed"], "employees", start)
+    return [
+        {
+            "employee_id": employee_id(n),
+            "name": person_name(plan["seed"], "employee", n),
+            "department": fake.random_element(elements=DEPARTMENTS),
+            "contact_number": fake.phone_number()
         }
-        vehicles.append(vehicle)
-    return vehicles
-
-# Generate fake Drivers
-def generate_fake_drivers(num_drivers):
-    drivers = []
-    for _ in range(num_drivers):
-        driver = {
-            "driver_id": fake.unique.bothify(text="DRV####"),
-            "name": fake.name(),
+        for n in range(start, end)
+    ]
+
+
+# One driver per vehicle, as the allocation flow expects
+def generate_drivers(plan, start, end):
+    fake = _faker(plan["seed"], "drivers", start)
+    return [
+        {
+            "driver_id": driver_id(n),
+            "name": person_name(plan["seed"], "driver", n),
             "contact_number": fake.phone_number(),
-            "license_number": fake.unique.bothify(text="LIC########"),
-            "assigned_vehicle_id": None  # will be assigned later
+            "license_number": f"LIC{n + 1:08d}",
+            "assigned_vehicle_id": vehicle_id(n)
+        }
+        for n in range(start, end)
+    ]
+
+
+def generate_vehicles(plan, start, end):
+    fake = _faker(plan["seed"], "vehicles", start)
+    return [
+        {
+            "vehicle_id": vehicle_id(n),
+            "vehicle_name": vehicle_name(plan["seed"], n),
+            "driver_id": driver_id(n),
+            "status": fake.random_element(elements=VEHICLE_STATUSES)
         }
-        drivers.append(driver)
-    return drivers
-
-# Assign drivers to vehicles and return all generated data
-def generate_fake_data():
-    drivers = generate_fake_drivers(NUM_DRIVERS)
-    vehicles = generate_fake_vehicles(NUM_VEHICLES, drivers)
-    employees = generate_fake_employees(NUM_EMPLOYEES)
-    
-    # Assign each driver to a vehicle
-    for i in range(len(drivers)):
-        drivers[i]["assigned_vehicle_id"] = vehicles[i]["vehicle_id"]
+        for n in range(start, end)
+    ]
+
 
+# Allocation k takes slot (stride * k + offset) mod slots of the vehicle x day
+# grid. The stride is coprime with the slot count, so that is a permutation:
+# every allocation gets its own (vehicle, date) without tracking used slots.
+def generate_allocations(plan, start, end):
+    rng = random.Random(f"{plan['seed']}:allocations:{start}")
+    vehicles = plan["vehicles"]
+    first_day = plan["first_day"]
+    today = plan["today"]
+    now = plan["now"]
+    allocations = []
+    for k in range(start, end):
+        slot = (plan["stride"] * k + plan["offset"]) % plan["slots"]
+        vehicle, day = slot % vehicles, slot // vehicles
+        allocation_date = first_day + timedelta(days=day)
+        employee = rng.randrange(plan["employees"])
+        cancel_rate = 0.10 if allocation_date < today else 0.05
+        created_at = min(
+            allocation_date - timedelta(days=rng.randint(1, 30), seconds=rng.randint(0, 86399)),
+            now
+        )
+        allocations.append({
+            "employee_id": employee_id(employee),
+            "vehicle_id": vehicle_id(vehicle),
+            "driver_id": driver_id(vehicle),
+            "allocation_date": allocation_date,
+            "status": "cancelled" if rng.random() < cancel_rate else "active",
+            "created_at": created_at,
+            "updated_at": created_at,
+            "employee_name": person_name(plan["seed"], "employee", employee),
+            "vehicle_name": vehicle_name(plan["seed"], vehicle),
+            "driver_name": person_name(plan["seed"], "driver", vehicle)
+        })
+    return allocations
+
+
+GENERATORS = {
+    "employees": generate_employees,
+    "drivers": generate_drivers,
+    "vehicles": generate_vehicles,
+    "allocations": generate_allocations,
+}
+
+# Per-process MongoDB client, opened by the pool initializer
+_worker = {}
+
+
+def init_worker(url, database_name):
+    _worker["database"] = MongoClient(url)[database_name]
+
+
+# Generate one batch and insert it; only this batch is ever held in memory
+def load_batch(task):
+    kind, start, end, plan = task
+    documents = GENERATORS[kind](plan, start, end)
+    try:
+        result = _worker["database"][kind].insert_many(documents, ordered=False)
+        return kind, len(result.inserted_ids), 0
+    except BulkWriteError as bwe:
+        return kind, bwe.details["nInserted"], len(bwe.details["writeErrors"])
+
+
+def make_plan(args):
+    today = datetime.combine(args.anchor_date, datetime.min.time())
+    days = args.history_days + args.future_days
+    slots = args.vehicles * days
+    if args.allocations > slots:
+        raise SystemExit(f"{args.allocations} allocations do not fit in {args.vehicles} vehicles x {days} days")
+    if args.allocations and not args.employees:
+        raise SystemExit("Allocations need at least one employee")
+
+    rng = random.Random(args.seed)
+    stride = rng.randrange(1, slots) if slots > 1 else 1
+    while gcd(stride, slots) != 1:
+        stride += 1
     return {
-        "employees": employees,
-        "vehicles": vehicles,
-        "drivers": drivers
+        "seed": args.seed,
+        "employees": args.employees,
+        "vehicles": args.vehicles,
+        "slots": slots,
+        "stride": stride,
+        "offset": rng.randrange(slots) if slots else 0,
+        "first_day": today - timedelta(days=args.history_days),
+        "today": today,
+        "now": min(datetime.utcnow(), today + timedelta(days=1))
     }
 
-# Function to insert data into MongoDB asynchronously
-async def insert_data_into_mongodb():
-    # Generate fake data
-    data = generate_fake_data()
 
-    try:
-        # Clear existing collections (optional)
-        await employees_collection.delete_many({})
-        await vehicles_collection.delete_many({})
-        await drivers_collection.delete_many({})
+def batches(args, plan):
+    counts = {
+        "employees": args.employees,
+        "drivers": args.vehicles,
+        "vehicles": args.vehicles,
+        "allocations": args.allocations,
+    }
+    for kind in ENTITIES:
+        for start in range(0, counts[kind], args.batch_size):
+            yield kind, start, min(start + args.batch_size, counts[kind]), plan
 
-        # Insert employees, vehicles, and drivers into MongoDB collections
-        result_employees = await employees_collection.insert_many(data['employees'])
-        result_vehicles = await vehicles_collection.insert_many(data['vehicles'])
-        result_drivers = await drivers_collection.insert_many(data['drivers'])
 
-        logging.info("Data inserted successfully into MongoDB!")
-        logging.info(f"Inserted Employees: {len(result_employees.inserted_ids)}")
-        logging.info(f"Inserted Vehicles: {len(result_vehicles.inserted_ids)}")
-        logging.info(f"Inserted Drivers: {len(result_drivers.inserted_ids)}")
+def build_indexes(database):
+    # Built after the load: one pass over the data is faster than maintaining them per insert
+    for collection_name, specs in INDEX_SPECS.items():
+        database[collection_name].create_indexes([
+            IndexModel(
+                spec["keys"], name=spec["name"],
+                **{option: spec[option] for option in INDEX_OPTIONS if spec.get(option)}
+            )
+            for spec in specs
+        ])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Populate MongoDB with deterministic fake data")
+    parser.add_argument("--employees", type=int, default=1000)
+    parser.add_argument("--vehicles", type=int, default=1000, help="Also the number of drivers (one per vehicle)")
+    parser.add_argument("--allocations", type=int, default=10000)
+    parser.add_argument("--history-days", type=int, default=365, help="Days of past allocations")
+    parser.add_argument("--future-days", type=int, default=30, help="Days of future allocations, from the anchor date")
+    parser.add_argument("--anchor-date", type=date.fromisoformat, default=date.today(), help="Date treated as today (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Generator processes")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents per insert_many")
+    parser.add_argument("--mongodb-url", default=MONGODB_URL)
+    parser.add_argument("--database", default=MONGODB_DATABASE, help="Database to populate (its collections are dropped)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    plan = make_plan(args)
+
+    client = MongoClient(args.mongodb_url)
+    client.admin.command("ping")
+    logging.info("Connected to MongoDB successfully!")
+    database = client[args.database]
+    for kind in ENTITIES:
+        database[kind].drop()
+
+    inserted = dict.fromkeys(ENTITIES, 0)
+    failed = dict.fromkeys(ENTITIES, 0)
+    started = time.perf_counter()
+    with Pool(args.workers, initializer=init_worker, initargs=(args.mongodb_url, args.database)) as pool:
+        for count, (kind, ok, errors) in enumerate(pool.imap_unordered(load_batch, batches(args, plan)), 1):
+            inserted[kind] += ok
+            failed[kind] += errors
+            if count % 100 == 0:
+                logging.info("Inserted %d documents", sum(inserted.values()))
+    elapsed = time.perf_counter() - started
+
+    logging.info("Building indexes")
+    build_indexes(database)
+    for kind in ENTITIES:
+        logging.info("Inserted %s: %d (%d failed)", kind.capitalize(), inserted[kind], failed[kind])
+    logging.info("%d documents in %.1fs (%.0f/s)", sum(inserted.values()), elapsed, sum(inserted.values()) / max(elapsed, 1e-9))
+    return 1 if any(failed.values()) else 0
 
-    except BulkWriteError as bwe:
-        logging.error("Bulk write error occurred:", bwe.details)
-    except Exception as e:
-        logging.error("An error occurred while inserting data:", e)
 
-# Create indexes for optimization
-async def create_indexes():
-    try:
-        await employees_collection.create_index("employee_id", unique=True)
-        await vehicles_collection.create_index("vehicle_id", unique=True)
-        await drivers_collection.create_index("driver_id", unique=True)
-    except Exception as e:
-        logging.error("An error occurred while creating indexes:", e)
-
-# Main function to run the tasks
-async def main():
-    await check_connection()  # Check the MongoDB connection
-    await create_indexes()
-    await insert_data_into_mongodb()
-
-# Run the async main function
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
+    sys.exit(main())
@@ -0,0 +1,196 @@
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+from redis.exceptions import RedisError
+from cache import shared_store
+from config import IDEMPOTENCY_TTL, IDEMPOTENCY_LOCK_TTL
+from metrics import IDEMPOTENT_REPLAYS
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+HEADER = b"idempotency-key"
+MAX_KEY_LENGTH = 255
+# Response headers that describe the original transfer rather than the result
+SKIPPED_HEADERS = {b"content-length", b"date", b"server"}
+
+
+def _json_response(status, detail):
+    body = json.dumps({"detail": detail}).encode()
+    return {
+        "status": status,
+        "headers": [["content-type", "application/json"]],
+        "body": base64.b64encode(body).decode(),
+        "replayed": False
+    }
+
+
+# Stores the first response to a request carrying an Idempotency-Key and
+# replays it for retries with the same key, without running the route (so
+# without touching MongoDB). Duplicates that arrive while the first request
+# is still running wait for its response: in-process through a shared future,
+# across processes through a short-lived lock in the shared store.
+class IdempotencyMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.inflight = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS:
+            await self.app(scope, receive, send)
+            return
+        key = dict(scope["headers"]).get(HEADER)
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await self._send_record(send, _json_response(400, "Idempotency-Key is too long"))
+            return
+
+        # The body is part of the fingerprint, so read it up front and replay it to the app
+        messages, body = [], b""
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        async def replay_receive():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        store_key = f"idem:{scope['method']}:{scope['path']}:{key.decode('latin-1')}"
+        fingerprint = hashlib.sha256(
+            b"\0".join([scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body])
+        ).hexdigest()
+
+        record = await self._handle(scope, replay_receive, send, store_key, fingerprint)
+        if record is not None:
+            await self._send_record(send, record)
+
+    async def _handle(self, scope, receive, send, store_key, fingerprint):
+        # Returns a record to send, or None once the response went out directly
+        while True:
+            waiter = self.inflight.get(store_key)
+            if waiter is not None:
+                record = await asyncio.shield(waiter)
+                if record is None:
+                    # The first attempt failed; this retry does the work itself
+                    continue
+                return self._replay(record, fingerprint)
+
+            future = asyncio.get_running_loop().create_future()
+            self.inflight[store_key] = future
+            try:
+                record = await self._load(store_key)
+                if record is None and not await self._lock(store_key):
+                    record = await self._wait_for_other_process(store_key)
+                    if record is None:
+                        continue
+                if record is not None:
+                    future.set_result(record)
+                    return self._replay(record, fingerprint)
+
+                # Save before unlocking so other processes never see neither
+                try:
+                    record = await self._run(scope, receive, send, fingerprint)
+                    if record is not None:
+                        await self._save(store_key, record)
+                finally:
+                    await self._unlock(store_key)
+                future.set_result(record)
+                return None
+            finally:
+                if not future.done():
+                    future.set_result(None)
+                self.inflight.pop(store_key, None)
+
+    async def _run(self, scope, receive, send, fingerprint):
+        # Pass the response through while keeping a copy of it
+        response = {"status": 500, "headers": [], "body": b""}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    [name.decode("latin-1"), value.decode("latin-1")]
+                    for name, value in message.get("headers", []) if name.lower() not in SKIPPED_HEADERS
+                ]
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+        # Server errors are not stored, so a retry gets another attempt
+        if response["status"] >= 500:
+            return None
+        return {
+            "fingerprint": fingerprint,
+            "status": response["status"],
+            "headers": response["headers"],
+            "body": base64.b64encode(response["body"]).decode()
+        }
+
+    def _replay(self, record, fingerprint):
+        if record["fingerprint"] != fingerprint:
+            return _json_response(422, "Idempotency-Key was already used with a different request")
+        IDEMPOTENT_REPLAYS.inc()
+        return {**record, "replayed": True}
+
+    async def _send_record(self, send, record):
+        headers = [[name.encode("latin-1"), value.encode("latin-1")] for name, value in record["headers"]]
+        if record.get("replayed"):
+            headers.append([b"idempotent-replayed", b"true"])
+        await send({"type": "http.response.start", "status": record["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": base64.b64decode(record["body"])})
+
+    async def _load(self, store_key):
+        try:
+            raw = await shared_store.get(store_key)
+        except (RedisError, OSError) as e:
+            logger.warning("Idempotency store read failed: %s", e)
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def _save(self, store_key, record):
+        try:
+            await shared_store.set(store_key, json.dumps(record), ex=IDEMPOTENCY_TTL)
+        except (RedisError, OSError) as e:
+            logger.warning("Idempotency store write failed: %s", e)
+
+    async def _lock(self, store_key):
+        try:
+            return bool(await shared_store.set(f"{store_key}:lock", "1", ex=IDEMPOTENCY_LOCK_TTL, nx=True))
+        except (RedisError, OSError) as e:
+            # Without the store, fall back to in-process coalescing only
+            logger.warning("Idempotency lock failed: %s", e)
+            return True
+
+    async def _unlock(self, store_key):
+        try:
+            await shared_store.delete(f"{store_key}:lock")
+        except (RedisError, OSError) as e:
+            logger.warning("Idempotency unlock failed: %s", e)
+
+    async def _wait_for_other_process(self, store_key):
+        # Another process holds the lock: poll until it stores its response or
+        # gives up the lock (None: try to take the lock ourselves)
+        deadline = time.monotonic() + IDEMPOTENCY_LOCK_TTL
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            record = await self._load(store_key)
+            if record is not None:
+                return record
+            try:
+                if await shared_store.get(f"{store_key}:lock") is None:
+                    return None
+            except (RedisError, OSError):
+                return None
+        return None
@@ -0,0 +1,268 @@
+import sys
+import asyncio
+import logging
+import argparse
+from datetime import datetime, date
+from bson import ObjectId
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+from config import database
+
+logger = logging.getLogger(__name__)
+
+# Every index the application relies on, per collection. Names are fixed so
+# the live indexes can be diffed against this spec.
+INDEX_SPECS = {
+    "employees": [
+        {"name": "employee_id_1", "keys": [("employee_id", 1)], "unique": True},
+    ],
+    "vehicles": [
+        {"name": "vehicle_id_1", "keys": [("vehicle_id", 1)], "unique": True},
+    ],
+    "drivers": [
+        {"name": "driver_id_1", "keys": [("driver_id", 1)], "unique": True},
+        # Driver lookup by vehicle in create_allocation
+        {"name": "assigned_vehicle_id_1", "keys": [("assigned_vehicle_id", 1)]},
+    ],
+    "allocations": [
+        # Only one active allocation per vehicle and date
+        {
+            "name": "vehicle_date_active_unique",
+            "keys": [("vehicle_id", 1), ("allocation_date", 1)],
+            "unique": True,
+            "partialFilterExpression": {"status": "active"},
+        },
+        # History sorted by (allocation_date, _id), unfiltered or by date range
+        {"name": "allocation_date_-1__id_-1", "keys": [("allocation_date", -1), ("_id", -1)]},
+        # History and renames filtered by employee, vehicle or status
+        {"name": "employee_history", "keys": [("employee_id", 1), ("allocation_date", -1), ("_id", -1)]},
+        {"name": "vehicle_history", "keys": [("vehicle_id", 1), ("allocation_date", -1), ("_id", -1)]},
+        {"name": "status_history", "keys": [("status", 1), ("allocation_date", -1), ("_id", -1)]},
+        # Driver renames
+        {"name": "driver_id_1", "keys": [("driver_id", 1)]},
+    ],
+    # Cold tier: the same history shapes, without the booking constraint
+    "allocations_archive": [
+        {"name": "allocation_date_-1__id_-1", "keys": [("allocation_date", -1), ("_id", -1)]},
+        {"name": "employee_history", "keys": [("employee_id", 1), ("allocation_date", -1), ("_id", -1)]},
+        {"name": "vehicle_history", "keys": [("vehicle_id", 1), ("allocation_date", -1), ("_id", -1)]},
+        {"name": "status_history", "keys": [("status", 1), ("allocation_date", -1), ("_id", -1)]},
+        {"name": "driver_id_1", "keys": [("driver_id", 1)]},
+    ],
+}
+
+# Options that make two indexes with the same keys different
+INDEX_OPTIONS = ("unique", "partialFilterExpression", "sparse", "expireAfterSeconds")
+
+
+def _options(index):
+    return {option: index[option] for option in INDEX_OPTIONS if index.get(option)}
+
+
+def _matches(spec, live):
+    return [tuple(key) for key in live["key"]] == list(spec["keys"]) and _options(spec) == _options(live)
+
+
+# Live indexes a spec would replace: same name, or same keys with other options
+def _conflicts(spec, live_indexes):
+    return [
+        name for name, index in live_indexes.items()
+        if name == spec["name"] or [tuple(key) for key in index["key"]] == list(spec["keys"])
+    ]
+
+
+# Work out what has to change on one collection to match its spec
+def diff_indexes(specs, live_indexes):
+    live_indexes = {name: index for name, index in live_indexes.items() if name != "_id_"}
+    missing, conflicting, extra = [], [], []
+
+    for spec in specs:
+        live = live_indexes.get(spec["name"])
+        if live is not None and _matches(spec, live):
+            continue
+        missing.append(spec)
+        # Same name or same keys with other options must be dropped first
+        for name in _conflicts(spec, live_indexes):
+            if name not in conflicting:
+                conflicting.append(name)
+
+    wanted = {spec["name"] for spec in specs if spec not in missing}
+    for name in live_indexes:
+        if name not in wanted and name not in conflicting:
+            extra.append(name)
+    return missing, conflicting, extra
+
+
+def _model(spec):
+    return IndexModel(spec["keys"], name=spec["name"], background=True, **_options(spec))
+
+
+# IndexOptionsConflict, IndexKeySpecsConflict: the server will not keep both indexes
+SIDE_BY_SIDE_CONFLICTS = (85, 86)
+
+
+async def replace_index(collection, spec, conflicts):
+    # Build the replacement next to the old index first, so a unique index
+    # keeps guarding writes for the whole swap
+    if spec["name"] not in conflicts:
+        try:
+            await collection.create_indexes([_model(spec)])
+        except OperationFailure as e:
+            if e.code not in SIDE_BY_SIDE_CONFLICTS:
+                raise
+            logger.warning("Cannot build %s.%s next to %s (%s); dropping first",
+                           collection.name, spec["name"], ", ".join(conflicts), e)
+        else:
+            for name in conflicts:
+                logger.info("Dropping index %s.%s (superseded by %s)", collection.name, name, spec["name"])
+                await collection.drop_index(name)
+            return
+    for name in conflicts:
+        logger.info("Dropping index %s.%s (superseded by %s)", collection.name, name, spec["name"])
+        await collection.drop_index(name)
+    await collection.create_indexes([_model(spec)])
+
+
+async def sync_indexes(prune=False, replace=False):
+    # Indexes that differ from the spec are only replaced when asked to
+    # (python indexes.py sync); the startup sync never drops an index, as it
+    # may be the only uniqueness guard the writes have
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = database[collection_name]
+        live_indexes = {
+            name: index for name, index in (await collection.index_information()).items() if name != "_id_"
+        }
+        missing, conflicting, extra = diff_indexes(specs, live_indexes)
+
+        blocked = [spec for spec in missing if _conflicts(spec, live_indexes)]
+        buildable = [spec for spec in missing if spec not in blocked]
+        if buildable:
+            logger.info("Building indexes on %s: %s", collection_name, ", ".join(spec["name"] for spec in buildable))
+            await collection.create_indexes([_model(spec) for spec in buildable])
+        for spec in blocked:
+            conflicts = _conflicts(spec, live_indexes)
+            if replace:
+                await replace_index(collection, spec, conflicts)
+            else:
+                logger.error(
+                    "Index %s.%s conflicts with %s and was not built; run python indexes.py sync to replace it",
+                    collection_name, spec["name"], ", ".join(conflicts)
+                )
+        for name in extra:
+            if prune:
+                logger.info("Dropping index %s.%s (not in spec)", collection_name, name)
+                await collection.drop_index(name)
+            else:
+                logger.warning("Index %s.%s is not in the spec", collection_name, name)
+
+
+async def has_booking_guard():
+    # vehicle_date_active_unique, or the full unique index it replaces: the
+    # only thing stopping two active allocations of a vehicle on one date
+    guard = next(spec for spec in INDEX_SPECS["allocations"] if spec["name"] == "vehicle_date_active_unique")
+    information = await database.allocations.index_information()
+    return any(
+        index.get("unique") and [tuple(key) for key in index["key"]] == list(guard["keys"])
+        and index.get("partialFilterExpression") in (None, guard["partialFilterExpression"])
+        for index in information.values()
+    )
+
+
+async def sync_indexes_in_background():
+    try:
+        await sync_indexes()
+        return True
+    except Exception as e:
+        logger.error("Index sync failed: %s", e)
+        return False
+
+
+def _sample_date():
+    return datetime.combine(date.today(), datetime.min.time())
+
+
+# The filter/sort shape of every query issued by the routes, with sample values
+def query_shapes():
+    day = _sample_date()
+    history_sort = {"allocation_date": -1, "_id": -1}
+    keyset = {"$or": [
+        {"allocation_date": {"$lt": day}},
+        {"allocation_date": day, "_id": {"$lt": ObjectId()}}
+    ]}
+    return [
+        ("create: employee lookup", "employees", {"employee_id": {"$in": ["EMP0001"]}}, None),
+        ("create: vehicle lookup", "vehicles", {"vehicle_id": {"$in": ["VEH00001"]}}, None),
+        ("create: driver lookup", "drivers", {"assigned_vehicle_id": {"$in": ["VEH00001"]}}, None),
+        ("update: conditional update", "allocations", {"_id": ObjectId(), "allocation_date": {"$gte": day}}, None),
+        ("delete: allocation lookup", "allocations", {"_id": ObjectId()}, None),
+        ("history: unfiltered", "allocations", {}, history_sort),
+        ("history: date range", "allocations", {"allocation_date": {"$gte": day, "$lte": day}}, history_sort),
+        ("history: by employee", "allocations", {"employee_id": "EMP0001"}, history_sort),
+        ("history: by vehicle", "allocations", {"vehicle_id": "VEH00001"}, history_sort),
+        ("history: by status", "allocations", {"status": "active"}, history_sort),
+        ("history: cursor page", "allocations", keyset, history_sort),
+        ("rename: driver allocations", "allocations", {"driver_id": "DRV0001"}, None),
+        ("history: archive tier", "allocations_archive", {"employee_id": "EMP0001"}, history_sort),
+        ("archive: rows past the horizon", "allocations", {"allocation_date": {"$lt": day}}, {"allocation_date": 1}),
+        ("occupancy: future bookings", "allocations", {"status": "active", "allocation_date": {"$gte": day}}, None),
+    ]
+
+
+def _has_collscan(plan):
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collscan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collscan(value) for value in plan)
+    return False
+
+
+def _winning_plans(explain):
+    if isinstance(explain, dict):
+        if "winningPlan" in explain:
+            yield explain["winningPlan"]
+        for value in explain.values():
+            yield from _winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from _winning_plans(value)
+
+
+async def explain_query_shapes():
+    failures = []
+    for name, collection_name, query, sort in query_shapes():
+        command = {"find": collection_name, "filter": query}
+        if sort:
+            command["sort"] = sort
+            command["limit"] = 10
+        explain = await database.command({"explain": command, "verbosity": "queryPlanner"})
+        collscan = any(_has_collscan(plan) for plan in _winning_plans(explain))
+        print(f"{'COLLSCAN' if collscan else 'ok':9} {name}")
+        if collscan:
+            failures.append(name)
+    return failures
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage and verify MongoDB indexes")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subcommands.add_parser("sync", help="Create missing indexes and replace ones that differ from the spec")
+    sync_parser.add_argument("--prune", action="store_true", help="Also drop indexes that are not in the spec")
+    subcommands.add_parser("explain", help="Fail if any route query shape is a collection scan")
+    args = parser.parse_args(argv)
+
+    if args.command == "sync":
+        await sync_indexes(prune=args.prune, replace=True)
+        return 0
+
+    failures = await explain_query_shapes()
+    if failures:
+        print(f"{len(failures)} query shape(s) use a COLLSCAN")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main()))
@@ -1,11 +1,91 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from config import create_indexes
+from fastapi.responses import JSONResponse
+from pymongo.errors import ConnectionFailure
+import asyncio
+import logging
+from admission import AdmissionMiddleware
+from archive import archive_forever
+from changefeed import change_feed
+from config import (
+    database, mongo, query_monitor, MONGODB_WARMUP_RETRY_SECONDS, ADMISSION_RETRY_AFTER, ARCHIVE_INTERVAL_SECONDS
+)
+from idempotency import IdempotencyMiddleware
+from indexes import has_booking_guard, sync_indexes_in_background
+from metrics import MetricsMiddleware, metrics_response_body
+from occupancy import occupancy_index
 from routes.routes import router
 
+logger = logging.getLogger(__name__)
+
+
+# Open the pool and load the occupancy index, retrying while MongoDB is
+# unreachable; then sync the indexes and wait for the booking guard index
+async def warm_up(app):
+    while True:
+        try:
+            await mongo.warm_up()
+            await occupancy_index.load()
+            break
+        except Exception as e:
+            logger.error("Warm-up failed, retrying in %.0fs: %s", MONGODB_WARMUP_RETRY_SECONDS, e)
+            await asyncio.sleep(MONGODB_WARMUP_RETRY_SECONDS)
+    app.state.occupancy_refresh = asyncio.create_task(occupancy_index.refresh_forever())
+    app.state.index_sync = asyncio.create_task(sync_indexes_until_done(app))
+
+    # Without the unique (vehicle, date) index nothing stops double bookings,
+    # so the app is not ready until it exists; other indexes keep building
+    while True:
+        try:
+            if await has_booking_guard():
+                break
+        except Exception as e:
+            logger.error("Booking guard index check failed: %s", e)
+        if app.state.index_sync.done():
+            logger.error("Index sync finished but the booking guard index is missing")
+            await asyncio.sleep(MONGODB_WARMUP_RETRY_SECONDS)
+        else:
+            await asyncio.wait({app.state.index_sync}, timeout=MONGODB_WARMUP_RETRY_SECONDS)
+    app.state.booking_guard = True
+    app.state.ready = True
+
+
+async def sync_indexes_until_done(app):
+    while not await sync_indexes_in_background():
+        app.state.indexes = "retrying"
+        await asyncio.sleep(MONGODB_WARMUP_RETRY_SECONDS)
+    app.state.indexes = "synced"
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Nothing here waits on MongoDB: the app starts serving at once and
+    # /ready reports when the pool is warm
+    app.state.ready = False
+    app.state.booking_guard = False
+    app.state.indexes = "pending"
+    mongo.connect()
+    query_monitor.attach(database, asyncio.get_running_loop())
+    app.state.warm_up = asyncio.create_task(warm_up(app))
+    app.state.change_feed = asyncio.create_task(change_feed.run())
+    if ARCHIVE_INTERVAL_SECONDS > 0:
+        app.state.archive = asyncio.create_task(archive_forever())
+    yield
+    for name in ("warm_up", "index_sync", "occupancy_refresh", "change_feed", "archive"):
+        task = getattr(app.state, name, None)
+        if task is not None and not task.done():
+            task.cancel()
+    mongo.close()
 
-app = FastAPI(title="Vehicle Allocation System")
 
+app = FastAPI(title="Vehicle Allocation System", lifespan=lifespan)
+
+# Bounded concurrency per route class; innermost, so replays skip it
+app.add_middleware(AdmissionMiddleware)
+# Replay stored responses for retried Idempotency-Key requests; inside CORS,
+# so CORS headers are added per request rather than replayed
+app.add_middleware(IdempotencyMiddleware)
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -13,13 +93,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+# Prometheus request metrics, exposed at /metrics
+app.add_middleware(MetricsMiddleware)
 app.include_router(router, prefix="/api", tags=["Vehicle Allocation"])
-@app.on_event("startup")
-async def startup_event():
-    await create_indexes()
+
+
+# Pool wait and server selection timeouts mean MongoDB is overloaded or
+# unreachable: tell the client to back off rather than report a 500
+@app.exception_handler(ConnectionFailure)
+async def database_unavailable(request, exc):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database unavailable, retry later"},
+        headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
+    )
 
 
 @app.get("/")
 async def root():
-    return {"message": "Vehicle Allocation System API"}
\ No newline at end of file
+    return {"message": "Vehicle Allocation System API"}
+
+
+# Readiness probe: 200 once the pool is warm, the occupancy index is loaded
+# and the booking guard index exists
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    is_ready = getattr(app.state, "ready", False)
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={
+            "status": "ready" if is_ready else "starting",
+            "mongodb_pool": "warm" if mongo.warm else "cold",
+            "occupancy_index": "loaded" if occupancy_index.loaded_at else "loading",
+            "booking_guard": "present" if getattr(app.state, "booking_guard", False) else "missing",
+            "indexes": getattr(app.state, "indexes", "pending")
+        }
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    body, content_type = metrics_response_body()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,278 @@
+import asyncio
+from types import SimpleNamespace
+import mongomock
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+# In-memory stand-in for the parts of Motor the application uses, built on
+# mongomock. Used by the benchmarks and tests instead of a live cluster;
+# `latency` adds a simulated network round trip to every database call,
+# and every call is recorded in `calls`.
+
+
+class MemoryCursor:
+    def __init__(self, collection, operation, produce):
+        self._collection = collection
+        self._operation = operation
+        self._produce = produce
+        self._modifiers = []
+        self._documents = None
+
+    def sort(self, *args, **kwargs):
+        self._modifiers.append(("sort", args, kwargs))
+        return self
+
+    def skip(self, count):
+        self._modifiers.append(("skip", (count,), {}))
+        return self
+
+    def limit(self, count):
+        self._modifiers.append(("limit", (count,), {}))
+        return self
+
+    async def _load(self):
+        if self._documents is None:
+            await self._collection._round_trip(self._operation)
+            cursor = self._produce()
+            for name, args, kwargs in self._modifiers:
+                cursor = getattr(cursor, name)(*args, **kwargs)
+            self._documents = list(cursor)
+        return self._documents
+
+    async def to_list(self, length=None):
+        documents = await self._load()
+        count = len(documents) if length is None else length
+        taken = documents[:count]
+        del documents[:count]
+        return taken
+
+    async def next(self):
+        documents = await self._load()
+        if not documents:
+            raise StopAsyncIteration
+        return documents.pop(0)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.next()
+
+
+class MemoryCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._collection = database._database[name]
+
+    async def _round_trip(self, operation):
+        self.database.client.calls.append((self.name, operation))
+        if self.database.client.latency:
+            await asyncio.sleep(self.database.client.latency)
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return MemoryCursor(self, "find", lambda: self._collection.find(filter or {}, projection, **kwargs))
+
+    async def find_one(self, filter=None, projection=None, **kwargs):
+        await self._round_trip("find_one")
+        return self._collection.find_one(filter or {}, projection, **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        return MemoryCursor(self, "aggregate", lambda: self._aggregate(list(pipeline)))
+
+    def _aggregate(self, pipeline):
+        # mongomock has no $unionWith: run the union branch and reapply the rest
+        for position, stage in enumerate(pipeline):
+            if "$unionWith" in stage:
+                union = stage["$unionWith"]
+                if isinstance(union, str):
+                    union = {"coll": union}
+                head = list(self._collection.aggregate(pipeline[:position])) if position else list(self._collection.find())
+                other = self.database._database[union["coll"]]
+                tail = list(other.aggregate(union.get("pipeline", []))) if union.get("pipeline") else list(other.find())
+                scratch = mongomock.MongoClient().db.scratch
+                if head or tail:
+                    scratch.insert_many(head + tail)
+                return iter(scratch.aggregate(pipeline[position + 1:]) if pipeline[position + 1:] else scratch.find())
+        return self._collection.aggregate(pipeline)
+
+    async def insert_one(self, document, **kwargs):
+        await self._round_trip("insert_one")
+        return self._collection.insert_one(document)
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        await self._round_trip("insert_many")
+        documents = list(documents)
+        if ordered:
+            return self._collection.insert_many(documents)
+        # mongomock stops at the first error; emulate unordered inserts
+        inserted, errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                inserted.append(self._collection.insert_one(document).inserted_id)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": document})
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": len(inserted),
+                "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []
+            })
+        return SimpleNamespace(inserted_ids=inserted, acknowledged=True)
+
+    async def update_one(self, filter, update, upsert=False, **kwargs):
+        await self._round_trip("update_one")
+        return self._collection.update_one(filter, update, upsert=upsert)
+
+    async def update_many(self, filter, update, upsert=False, **kwargs):
+        await self._round_trip("update_many")
+        return self._collection.update_many(filter, update, upsert=upsert)
+
+    async def find_one_and_update(self, filter, update, projection=None, return_document=ReturnDocument.BEFORE, upsert=False, **kwargs):
+        await self._round_trip("find_one_and_update")
+        return self._collection.find_one_and_update(
+            filter, update, projection=projection, upsert=upsert, return_document=return_document
+        )
+
+    async def delete_one(self, filter, **kwargs):
+        await self._round_trip("delete_one")
+        return self._collection.delete_one(filter)
+
+    async def delete_many(self, filter, **kwargs):
+        await self._round_trip("delete_many")
+        return self._collection.delete_many(filter)
+
+    async def count_documents(self, filter, **kwargs):
+        await self._round_trip("count_documents")
+        return self._collection.count_documents(filter)
+
+    async def estimated_document_count(self, **kwargs):
+        await self._round_trip("estimated_document_count")
+        return self._collection.estimated_document_count()
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        await self._round_trip("bulk_write")
+        counts = {"inserted_count": 0, "matched_count": 0, "modified_count": 0, "deleted_count": 0, "upserted_count": 0}
+        errors = []
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._collection.insert_one(request._doc)
+                    counts["inserted_count"] += 1
+                    continue
+                if isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                    if isinstance(request, UpdateOne):
+                        result = self._collection.update_one(request._filter, request._doc, upsert=request._upsert)
+                    elif isinstance(request, UpdateMany):
+                        result = self._collection.update_many(request._filter, request._doc, upsert=request._upsert)
+                    else:
+                        result = self._collection.replace_one(request._filter, request._doc, upsert=request._upsert)
+                    counts["matched_count"] += result.matched_count
+                    counts["modified_count"] += result.modified_count
+                    counts["upserted_count"] += result.upserted_id is not None
+                    continue
+                if isinstance(request, DeleteOne):
+                    counts["deleted_count"] += self._collection.delete_one(request._filter).deleted_count
+                elif isinstance(request, DeleteMany):
+                    counts["deleted_count"] += self._collection.delete_many(request._filter).deleted_count
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": counts["inserted_count"],
+                "nUpserted": counts["upserted_count"], "nMatched": counts["matched_count"],
+                "nModified": counts["modified_count"], "nRemoved": counts["deleted_count"], "upserted": []
+            })
+        return SimpleNamespace(acknowledged=True, upserted_ids={}, **counts)
+
+    async def create_index(self, keys, **kwargs):
+        await self._round_trip("create_index")
+        kwargs.pop("background", None)
+        return self._collection.create_index(keys, **kwargs)
+
+    async def create_indexes(self, models, **kwargs):
+        await self._round_trip("create_indexes")
+        names = []
+        for model in models:
+            options = dict(model.document)
+            keys = list(options.pop("key").items())
+            options.pop("background", None)
+            names.append(self._collection.create_index(keys, **options))
+        return names
+
+    async def index_information(self, **kwargs):
+        await self._round_trip("index_information")
+        information = self._collection.index_information()
+        for index in information.values():
+            index["key"] = list(index["key"])
+        return information
+
+    async def drop_index(self, name, **kwargs):
+        await self._round_trip("drop_index")
+        return self._collection.drop_index(name)
+
+    async def drop(self, **kwargs):
+        await self._round_trip("drop")
+        return self._collection.drop()
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("Change streams are not supported by the in-memory database", code=40573)
+
+
+class MemoryDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._database = client._client[name]
+        self._collections = {}
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, command, **kwargs):
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        raise OperationFailure(f"Command {name} is not supported by the in-memory database")
+
+    async def list_collection_names(self, **kwargs):
+        return self._database.list_collection_names()
+
+
+class MemoryClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        # (collection, operation) of every call, in order; tests assert on it
+        self.calls = []
+        self._client = mongomock.MongoClient()
+        self._databases = {}
+
+    def __getitem__(self, name):
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(self, name)
+        return database
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name):
+        return self[name]
+
+    @property
+    def admin(self):
+        return self["admin"]
+
+    def close(self):
+        pass
@@ -0,0 +1,129 @@
+import time
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from pymongo import monitoring
+
+# Buckets in seconds, from sub-millisecond cache hits to multi-second scans
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_COUNT = Counter(
+    "http_requests_total", "HTTP requests by route and status code",
+    ["method", "route", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route and status code",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served",
+    ["method"]
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by collection and command",
+    ["collection", "command", "outcome"], buckets=LATENCY_BUCKETS
+)
+MONGO_POOL_CHECKOUT_WAIT = Histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time spent waiting to check a connection out of the pool",
+    ["outcome"], buckets=LATENCY_BUCKETS
+)
+
+IDEMPOTENT_REPLAYS = Counter(
+    "http_idempotent_replays_total", "Responses replayed for a repeated Idempotency-Key"
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight", "Requests holding an admission slot, by route class",
+    ["route_class"]
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth", "Requests waiting for an admission slot, by route class",
+    ["route_class"]
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "admission_queue_wait_seconds", "Time queued requests waited for an admission slot",
+    ["route_class"], buckets=LATENCY_BUCKETS
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "Requests shed with a 503 because the queue was full or the wait timed out",
+    ["route_class"]
+)
+
+# Fed by the QueryMonitor for every finished command
+def observe_command(collection, command, duration_ms, failed):
+    MONGO_COMMAND_LATENCY.labels(
+        collection or "", command, "failure" if failed else "success"
+    ).observe(duration_ms / 1000)
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    def connection_checked_out(self, event):
+        if event.duration is not None:
+            MONGO_POOL_CHECKOUT_WAIT.labels("success").observe(event.duration)
+
+    def connection_check_out_failed(self, event):
+        if event.duration is not None:
+            MONGO_POOL_CHECKOUT_WAIT.labels("failure").observe(event.duration)
+
+    # The remaining pool events are not measured
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+# Plain ASGI middleware so the per-request overhead stays at a few label lookups
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started
+            in_flight.dec()
+            # Label by route template, never the raw path, to bound cardinality
+            route = scope.get("route")
+            route_label = getattr(route, "path", None) or "unmatched"
+            REQUEST_COUNT.labels(method, route_label, status).inc()
+            REQUEST_LATENCY.labels(method, route_label, status).observe(duration)
+
+
+def metrics_response_body():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,59 @@
+import os
+import sys
+import asyncio
+import logging
+from pymongo import UpdateMany
+
+# Allow running as a script from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import database
+from archive import ARCHIVE_COLLECTION
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+BATCH_SIZE = 1000
+
+# (reference collection, reference key, reference name field, allocation name field)
+REFERENCES = [
+    ("employees", "employee_id", "name", "employee_name"),
+    ("vehicles", "vehicle_id", "vehicle_name", "vehicle_name"),
+    ("drivers", "driver_id", "name", "driver_name"),
+]
+
+
+# Both tiers: rows archived before the backfill need the names too
+ALLOCATION_COLLECTIONS = ("allocations", ARCHIVE_COLLECTION)
+
+
+# Copy one reference collection's names onto every allocation that points at it
+async def backfill_reference(collection, key_field, name_field, allocation_field, allocation_collection="allocations"):
+    operations = []
+    modified = 0
+    cursor = database[collection].find({}, {"_id": 0, key_field: 1, name_field: 1})
+    async for document in cursor:
+        operations.append(UpdateMany(
+            {key_field: document[key_field], allocation_field: {"$ne": document.get(name_field)}},
+            {"$set": {allocation_field: document.get(name_field)}}
+        ))
+        if len(operations) == BATCH_SIZE:
+            result = await database[allocation_collection].bulk_write(operations, ordered=False)
+            modified += result.modified_count
+            operations = []
+    if operations:
+        result = await database[allocation_collection].bulk_write(operations, ordered=False)
+        modified += result.modified_count
+    logging.info(f"Backfilled {allocation_field} on {modified} {allocation_collection}")
+    return modified
+
+
+async def main():
+    for allocation_collection in ALLOCATION_COLLECTIONS:
+        for reference in REFERENCES:
+            await backfill_reference(*reference, allocation_collection)
+
+
+# Run the async main function
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,11 @@
-from datetime import datetime, date
-from typing import Optional
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional
 from pydantic import BaseModel, Field, validator
 from bson import ObjectId
 
+MAX_BULK_ALLOCATIONS = 1000
+MAX_SERIES_DAYS = 366
+
 class PydanticObjectId(str):
     @classmethod
     def __get_validators__(cls):
@@ -68,8 +71,120 @@ class AllocationUpdate(BaseModel):
     allocation_date: Optional[date] = None
     status: Optional[str] = None
 
-    @validator('allocation_date', pre=True, always=True)
+    @validator('allocation_date', always=True)
     def validate_allocation_date(cls, v):
         if v is not None and v < date.today():
             raise ValueError("Cannot allocate vehicle for past dates")
-        return v
\ No newline at end of file
+        return v
+
+# No past-date validator: a past date fails its own item, not the whole batch
+class BulkAllocationItem(BaseModel):
+    employee_id: str
+    vehicle_id: str
+    allocation_date: date
+    status: str = "active"
+
+class BulkAllocationCreate(BaseModel):
+    allocations: List[BulkAllocationItem]
+
+    @validator('allocations')
+    def validate_batch_size(cls, v):
+        if not v:
+            raise ValueError("At least one allocation is required")
+        if len(v) > MAX_BULK_ALLOCATIONS:
+            raise ValueError(f"Cannot create more than {MAX_BULK_ALLOCATIONS} allocations per request")
+        return v
+
+class BulkAllocationResult(BaseModel):
+    index: int
+    success: bool
+    allocation_id: Optional[str] = None
+    status_code: int
+    detail: Optional[str] = None
+
+class BulkAllocationResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkAllocationResult]
+
+class AllocationSeriesCreate(BaseModel):
+    employee_id: str
+    vehicle_id: str
+    start_date: date
+    end_date: date
+    # Days of the week to book (0 = Monday ... 6 = Sunday); every day if omitted
+    weekdays: Optional[List[int]] = None
+    status: str = "active"
+    # all_or_nothing books every date or none; partial books the free dates
+    mode: str = Field("all_or_nothing", pattern="^(all_or_nothing|partial)$")
+
+    @validator('start_date')
+    def validate_start_date(cls, v):
+        if v < date.today():
+            raise ValueError("Cannot allocate vehicle for past dates")
+        return v
+
+    @validator('end_date')
+    def validate_end_date(cls, v, values):
+        start_date = values.get('start_date')
+        if start_date is not None:
+            if v < start_date:
+                raise ValueError("end_date must not be before start_date")
+            if (v - start_date).days >= MAX_SERIES_DAYS:
+                raise ValueError(f"A series cannot span more than {MAX_SERIES_DAYS} days")
+        return v
+
+    @validator('weekdays')
+    def validate_weekdays(cls, v):
+        if v is not None:
+            if not v or any(day < 0 or day > 6 for day in v):
+                raise ValueError("weekdays must be a non-empty list of 0 (Monday) to 6 (Sunday)")
+            v = sorted(set(v))
+        return v
+
+    def dates(self):
+        days = (self.end_date - self.start_date).days + 1
+        return [
+            self.start_date + timedelta(days=offset) for offset in range(days)
+            if self.weekdays is None or (self.start_date + timedelta(days=offset)).weekday() in self.weekdays
+        ]
+
+class AllocationSeriesResult(BaseModel):
+    allocation_date: date
+    success: bool
+    allocation_id: Optional[str] = None
+    status_code: int
+    detail: Optional[str] = None
+
+class AllocationSeriesResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[AllocationSeriesResult]
+
+class HistoryMeta(BaseModel):
+    total: int
+    # True when total is the collection's estimated count (no filters set)
+    estimated: bool = False
+    # Per-status and per-vehicle counts; None for unfiltered history
+    by_status: Optional[Dict[str, int]] = None
+    by_vehicle: Optional[Dict[str, int]] = None
+
+class HistoryPage(BaseModel):
+    items: List[AllocationResponse]
+    meta: HistoryMeta
+
+class EmployeeUpdate(BaseModel):
+    name: str
+
+class VehicleUpdate(BaseModel):
+    vehicle_name: str
+
+class VehicleStatusUpdate(BaseModel):
+    status: str = Field(..., pattern="^(available|maintenance|retired)$")
+    # What happens to the vehicle's future active allocations when it leaves service
+    action: str = Field("cancel", pattern="^(cancel|reassign)$")
+    # Vehicles to reassign to; any available vehicle if omitted
+    pool: Optional[List[str]] = None
+
+class DriverUpdate(BaseModel):
+    name: str
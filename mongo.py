@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from motor.motor_asyncio import AsyncIOMotorClient
+
+logger = logging.getLogger(__name__)
+
+
+# Stands in for the Motor database object that modules import from config.
+# Attribute and item access resolve against the live client, so the client
+# itself can be created (or swapped) after import.
+class DatabaseProxy:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection.get_database(), name)
+
+    def __getitem__(self, name):
+        return self._connection.get_database()[name]
+
+
+# Owns the Motor client for the app lifespan: created on startup (or lazily
+# on first use by scripts), pre-warmed to minPoolSize and closed on shutdown.
+class MongoConnection:
+    def __init__(self, url, database_name, **options):
+        self.url = url
+        self.database_name = database_name
+        self.options = options
+        self.client = None
+        self.warm = False
+        self.database = DatabaseProxy(self)
+
+    def connect(self):
+        # The constructor does no I/O; connections are opened by warm_up or first use
+        if self.client is None:
+            self.client = AsyncIOMotorClient(self.url, **self.options)
+        return self.client
+
+    def use(self, client, database_name=None):
+        # Swap in another client (benchmarks, tests)
+        self.close()
+        self.client = client
+        if database_name:
+            self.database_name = database_name
+
+    def get_database(self):
+        return self.connect()[self.database_name]
+
+    async def warm_up(self):
+        # Concurrent pings check out (and so open) minPoolSize connections now
+        # rather than on the first requests after a deploy or scale-out
+        client = self.connect()
+        count = max(1, self.options.get("minPoolSize") or 0)
+        await asyncio.gather(*[client.admin.command("ping") for _ in range(count)])
+        self.warm = True
+        logger.info("MongoDB pool warmed with %d connection(s)", count)
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.client = None
+        self.warm = False
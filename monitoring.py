@@ -0,0 +1,180 @@
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from fastapi import Request
+from pymongo import monitoring
+
+logger = logging.getLogger("slow_queries")
+
+# Route that issued the current database command ("METHOD /path/template").
+# Motor copies the context into its executor threads, so the listener sees it.
+current_route = contextvars.ContextVar("current_route", default=None)
+
+# Driver-internal commands that are not worth recording
+IGNORED_COMMANDS = {
+    "hello", "ismaster", "isMaster", "ping", "buildinfo", "buildInfo", "endSessions",
+    "saslStart", "saslContinue", "authenticate", "getnonce", "explain", "killCursors"
+}
+
+# Commands that can be explained, and the session/transport fields to strip first
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+TRANSPORT_FIELDS = {"lsid", "txnNumber", "apiVersion", "apiStrict", "apiDeprecationErrors", "comment"}
+
+
+# Router dependency that tags every database command with its route
+async def tag_route(request: Request):
+    route = request.scope.get("route")
+    current_route.set(f"{request.method} {route.path if route else request.url.path}")
+
+
+# Keep the query shape (keys and operators) but none of the values
+def redact(value):
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], (dict, list, tuple)):
+            return [redact(item) for item in value]
+        return ["?"] if value else []
+    return "?"
+
+
+def command_shape(command_name, command):
+    shape = {}
+    for key, value in command.items():
+        if key.startswith("$") or key in TRANSPORT_FIELDS:
+            continue
+        if key == command_name or key in ("limit", "batchSize", "ordered", "new", "upsert", "cursor"):
+            shape[key] = value
+        elif key == "documents":
+            shape[key] = f"<{len(value)} documents>"
+        else:
+            shape[key] = redact(value)
+    return shape
+
+
+# Aggregations on older servers nest the planner under the $cursor stage
+def query_planner(explain):
+    if "queryPlanner" in explain:
+        return explain["queryPlanner"]
+    for stage in explain.get("stages") or []:
+        if "$cursor" in stage:
+            return stage["$cursor"].get("queryPlanner", {})
+    return {}
+
+
+# Only stages and indexes: parsedQuery and indexBounds carry filter values
+def plan_summary(plan):
+    plan = plan.get("queryPlan", plan)
+    summary = {key: plan[key] for key in ("stage", "indexName", "keyPattern") if key in plan}
+    if "inputStage" in plan:
+        summary["inputStage"] = plan_summary(plan["inputStage"])
+    if "inputStages" in plan:
+        summary["inputStages"] = [plan_summary(stage) for stage in plan["inputStages"]]
+    return summary
+
+
+class QueryMonitor(monitoring.CommandListener):
+    def __init__(self, slow_ms, log_size=200, explain=False):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.slow = deque(maxlen=log_size)
+        self.stats = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._database = None
+        self._loop = None
+        # Callables (collection, command, duration_ms, failed) fed every finished command
+        self.observers = []
+
+    def attach(self, database, loop):
+        # Needed to run explain for slow commands from the listener threads
+        self._database = database
+        self._loop = loop
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        pending = {
+            "route": current_route.get(),
+            "command": event.command_name,
+            "collection": collection if isinstance(collection, str) else None,
+            "database": event.database_name,
+            "started": time.time()
+        }
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            pending["raw"] = event.command
+        with self._lock:
+            self._pending[(event.request_id, event.connection_id)] = pending
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed):
+        with self._lock:
+            pending = self._pending.pop((event.request_id, event.connection_id), None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        key = (pending["route"], pending["collection"], pending["command"])
+        with self._lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = {"count": 0, "failures": 0, "total_ms": 0.0, "max_ms": 0.0}
+            stats["count"] += 1
+            stats["failures"] += failed
+            stats["total_ms"] += duration_ms
+            stats["max_ms"] = max(stats["max_ms"], duration_ms)
+        for observer in self.observers:
+            observer(pending["collection"], pending["command"], duration_ms, failed)
+
+        if duration_ms < self.slow_ms:
+            return
+        raw = pending.pop("raw", None)
+        entry = {
+            "timestamp": pending["started"],
+            "route": pending["route"],
+            "collection": pending["collection"],
+            "command": pending["command"],
+            "duration_ms": round(duration_ms, 3),
+            "failed": failed,
+            "shape": command_shape(pending["command"], raw or {}) if raw else None,
+            "explain": None
+        }
+        self.slow.append(entry)
+        logger.warning(
+            "Slow %s on %s from %s: %.1f ms %s",
+            entry["command"], entry["collection"], entry["route"], duration_ms, entry["shape"]
+        )
+        if self.explain and raw and self._loop is not None and not failed:
+            asyncio.run_coroutine_threadsafe(self._explain(entry, pending["database"], raw), self._loop)
+
+    async def _explain(self, entry, database_name, raw):
+        command = {key: value for key, value in raw.items() if not key.startswith("$") and key not in TRANSPORT_FIELDS}
+        try:
+            result = await self._database.client[database_name].command(
+                {"explain": command, "verbosity": "queryPlanner"}
+            )
+            entry["explain"] = {"winningPlan": plan_summary(query_planner(result).get("winningPlan") or {})}
+        except Exception as e:
+            entry["explain"] = {"error": str(e)}
+
+    def report(self):
+        with self._lock:
+            commands = [
+                {
+                    "route": route, "collection": collection, "command": command,
+                    **stats, "avg_ms": stats["total_ms"] / stats["count"]
+                }
+                for (route, collection, command), stats in self.stats.items()
+            ]
+        commands.sort(key=lambda item: item["total_ms"], reverse=True)
+        return {"slow_ms": self.slow_ms, "commands": commands, "slow": list(self.slow)}
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from datetime import datetime, date, timedelta
+from config import database, OCCUPANCY_REFRESH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+# In-process vehicle x date occupancy bitmap. Each vehicle owns one bit
+# position; every day maps to an int whose set bits are the vehicles with
+# an active allocation on that day, so availability over a date range is a
+# handful of bitwise ORs instead of a scan of the allocations collection.
+class OccupancyIndex:
+    def __init__(self):
+        self.vehicle_ids = []
+        self.positions = {}
+        self.available_mask = 0
+        self.days = {}
+        self.loaded_at = None
+        # Writes made while a load is reading the database, replayed onto
+        # the fresh index before it is swapped in
+        self._during_load = None
+
+    def _position(self, vehicle_id):
+        position = self.positions.get(vehicle_id)
+        if position is None:
+            position = len(self.vehicle_ids)
+            self.positions[vehicle_id] = position
+            self.vehicle_ids.append(vehicle_id)
+        return position
+
+    def set_vehicle_status(self, vehicle_id, status):
+        if self._during_load is not None:
+            self._during_load.append(("set_vehicle_status", vehicle_id, status))
+        bit = 1 << self._position(vehicle_id)
+        if status == "available":
+            self.available_mask |= bit
+        else:
+            self.available_mask &= ~bit
+
+    def book(self, vehicle_id, allocation_date):
+        day = as_date(allocation_date)
+        self.days[day] = self.days.get(day, 0) | (1 << self._position(vehicle_id))
+
+    def release(self, vehicle_id, allocation_date):
+        day = as_date(allocation_date)
+        position = self.positions.get(vehicle_id)
+        if position is None or day not in self.days:
+            return
+        remaining = self.days[day] & ~(1 << position)
+        if remaining:
+            self.days[day] = remaining
+        else:
+            del self.days[day]
+
+    def apply(self, before, after):
+        # Reflect a write: before/after are allocation documents or None
+        if self._during_load is not None:
+            self._during_load.append(("apply", before, after))
+        if before and before.get("status") == "active":
+            self.release(before["vehicle_id"], before["allocation_date"])
+        if after and after.get("status") == "active":
+            self.book(after["vehicle_id"], after["allocation_date"])
+
+    def is_free(self, vehicle_id, allocation_date):
+        position = self.positions.get(vehicle_id)
+        if position is None:
+            return True
+        return not (self.days.get(as_date(allocation_date), 0) >> position) & 1
+
+    def available(self, start, end):
+        busy = 0
+        day = start
+        while day <= end:
+            busy |= self.days.get(day, 0)
+            day += timedelta(days=1)
+        free = self.available_mask & ~busy
+
+        vehicle_ids = []
+        while free:
+            lowest = free & -free
+            vehicle_ids.append(self.vehicle_ids[lowest.bit_length() - 1])
+            free ^= lowest
+        return vehicle_ids
+
+    async def load(self):
+        # Build into a fresh index and swap, so readers never see a partial state
+        fresh = OccupancyIndex()
+        self._during_load = []
+        try:
+            await self._read(fresh)
+        finally:
+            during_load, self._during_load = self._during_load, None
+        # Replaying a write the reads already saw leaves the same state
+        for method, *arguments in during_load:
+            getattr(fresh, method)(*arguments)
+
+        self.vehicle_ids = fresh.vehicle_ids
+        self.positions = fresh.positions
+        self.available_mask = fresh.available_mask
+        self.days = fresh.days
+        self.loaded_at = datetime.utcnow()
+        logger.info("Occupancy index loaded: %d vehicles, %d booked days", len(self.vehicle_ids), len(self.days))
+
+    async def _read(self, fresh):
+        vehicles = database.vehicles.find({}, {"_id": 0, "vehicle_id": 1, "status": 1})
+        async for vehicle in vehicles:
+            fresh.set_vehicle_status(vehicle["vehicle_id"], vehicle.get("status"))
+
+        today = datetime.combine(date.today(), datetime.min.time())
+        allocations = database.allocations.find(
+            {"status": "active", "allocation_date": {"$gte": today}},
+            {"_id": 0, "vehicle_id": 1, "allocation_date": 1}
+        )
+        async for allocation in allocations:
+            fresh.book(allocation["vehicle_id"], allocation["allocation_date"])
+
+    async def refresh_forever(self):
+        # Periodic rebuild picks up writes made by other processes and drops past days
+        while True:
+            await asyncio.sleep(OCCUPANCY_REFRESH_SECONDS)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error("Occupancy index refresh failed: %s", e)
+
+
+occupancy_index = OccupancyIndex()
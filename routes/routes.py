@@ -1,45 +1,68 @@
-from fastapi import APIRouter, HTTPException, Query
-from typing import List, Optional
+import asyncio
+import base64
+import csv
+import io
+import json
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from typing import List, Optional, Union
 from datetime import datetime, date
 from bson import ObjectId
-from models.models import AllocationResponse, AllocationCreate, AllocationUpdate
-from config import database
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, PyMongoError
+from models.models import (
+    AllocationResponse, AllocationCreate, AllocationUpdate,
+    BulkAllocationCreate, BulkAllocationResult, BulkAllocationResponse,
+    AllocationSeriesCreate, AllocationSeriesResult, AllocationSeriesResponse,
+    HistoryMeta, HistoryPage, VehicleStatusUpdate,
+    EmployeeUpdate, VehicleUpdate, DriverUpdate
+)
+from config import database, query_monitor, FAST_SERIALIZATION, CHANGE_FEED_KEEPALIVE_SECONDS, LOCAL_CACHE_TTL
+from archive import ARCHIVE_COLLECTION, reaches_archive
+from changefeed import change_feed
+from cache import employee_cache, vehicle_cache, driver_cache, history_cache, cache_stats
+from occupancy import occupancy_index
+from monitoring import tag_route
+from serialization import FastJSONResponse, allocation_json, dumps
 
-router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Every route tags the database commands it issues for the slow query log
+router = APIRouter(dependencies=[Depends(tag_route)])
+
+MAX_AVAILABILITY_DAYS = 366
 
 @router.post("/allocations", response_model=AllocationResponse)
 async def create_allocation(allocation: AllocationCreate):
     try:
+        # Convert allocation_date to datetime for comparison
+        allocation_date = datetime.combine(allocation.allocation_date, datetime.min.time())
+
+        # The lookups are independent, so issue them concurrently;
+        # reference data is served from the cache
+        employee, vehicle, driver = await asyncio.gather(
+            employee_cache.get(allocation.employee_id),
+            vehicle_cache.get(allocation.vehicle_id),
+            driver_cache.get(allocation.vehicle_id)
+        )
+
         # Validate employee exists
-        employee = await database.employees.find_one({"employee_id": allocation.employee_id})
         if not employee:
             raise HTTPException(status_code=404, detail="Employee not found")
 
         # Validate vehicle and its availability
-        vehicle = await database.vehicles.find_one({"vehicle_id": allocation.vehicle_id})
         if not vehicle:
             raise HTTPException(status_code=404, detail="Vehicle not found")
         if vehicle["status"] != "available":
             raise HTTPException(status_code=400, detail="Vehicle not available")
 
-        # Convert allocation_date to datetime for comparison
-        allocation_date = datetime.combine(allocation.allocation_date, datetime.min.time())
-
-        # Check if vehicle is already allocated for the date
-        existing = await database.allocations.find_one({
-            "vehicle_id": allocation.vehicle_id,
-            "allocation_date": allocation_date,
-            "status": "active"
-        })
-        if existing:
-            raise HTTPException(status_code=400, detail="Vehicle already allocated for this date")
-
         # Get pre-assigned driver
-        driver = await database.drivers.find_one({"assigned_vehicle_id": allocation.vehicle_id})
         if not driver:
             raise HTTPException(status_code=404, detail="No driver assigned to vehicle")
 
-        # Create allocation document
+        # Create allocation document with the display names denormalized
         now = datetime.utcnow()
         allocation_data = {
             "employee_id": allocation.employee_id,
@@ -48,11 +71,21 @@ async def create_allocation(allocation: AllocationCreate):
             "allocation_date": allocation_date,
             "status": allocation.status,
             "created_at": now,
-            "updated_at": now
+            "updated_at": now,
+            "employee_name": employee["name"],
+            "vehicle_name": vehicle["vehicle_name"],
+            "driver_name": driver.get("name")
         }
 
-        # Insert into database
-        result = await database.allocations.insert_one(allocation_data)
+        # Insert into database; the partial unique index on active
+        # (vehicle_id, allocation_date) rejects double bookings atomically
+        try:
+            result = await database.allocations.insert_one(allocation_data)
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Vehicle already allocated for this date")
+        await history_cache.invalidate([allocation.employee_id], [allocation.vehicle_id])
+        occupancy_index.apply(None, allocation_data)
+        change_feed.record(None, allocation_data)
 
         # Prepare response
         response_data = {
@@ -60,12 +93,293 @@ async def create_allocation(allocation: AllocationCreate):
             **allocation_data
         }
 
+        if FAST_SERIALIZATION:
+            return FastJSONResponse(allocation_json(response_data))
         return AllocationResponse(**response_data)
 
+    except (HTTPException, ConnectionFailure):
+        # ConnectionFailure is answered with a 503 by the app-level handler
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/allocations/bulk", response_model=BulkAllocationResponse)
+async def create_allocations_bulk(bulk: BulkAllocationCreate):
+    items = bulk.allocations
+    employee_ids = list({item.employee_id for item in items})
+    vehicle_ids = list({item.vehicle_id for item in items})
+
+    # Fetch every referenced document with at most one $in query per collection;
+    # conflicts with stored allocations are reported by the unique index on insert
+    employees, vehicles, drivers = await asyncio.gather(
+        employee_cache.get_many(employee_ids),
+        vehicle_cache.get_many(vehicle_ids),
+        driver_cache.get_many(vehicle_ids)
+    )
+
+    # Vehicle/date pairs already claimed by earlier items in this batch
+    booked = set()
+
+    # Validate each item in the same order as create_allocation
+    results = [None] * len(items)
+    documents = []
+    document_indexes = []
+    now = datetime.utcnow()
+    today = date.today()
+    for index, item in enumerate(items):
+        allocation_date = datetime.combine(item.allocation_date, datetime.min.time())
+        error = None
+        if item.allocation_date < today:
+            error = (400, "Cannot allocate vehicle for past dates")
+        elif item.employee_id not in employees:
+            error = (404, "Employee not found")
+        elif item.vehicle_id not in vehicles:
+            error = (404, "Vehicle not found")
+        elif vehicles[item.vehicle_id]["status"] != "available":
+            error = (400, "Vehicle not available")
+        elif item.status == "active" and (item.vehicle_id, allocation_date) in booked:
+            error = (400, "Vehicle already allocated for this date")
+        elif item.vehicle_id not in drivers:
+            error = (404, "No driver assigned to vehicle")
+
+        if error:
+            results[index] = BulkAllocationResult(index=index, success=False, status_code=error[0], detail=error[1])
+            continue
+
+        if item.status == "active":
+            booked.add((item.vehicle_id, allocation_date))
+
+        driver = drivers[item.vehicle_id]
+        documents.append({
+            "employee_id": item.employee_id,
+            "vehicle_id": item.vehicle_id,
+            "driver_id": driver["driver_id"],
+            "allocation_date": allocation_date,
+            "status": item.status,
+            "created_at": now,
+            "updated_at": now,
+            "employee_name": employees[item.employee_id]["name"],
+            "vehicle_name": vehicles[item.vehicle_id]["vehicle_name"],
+            "driver_name": driver.get("name")
+        })
+        document_indexes.append(index)
+
+    # Insert all valid items in one unordered batch
+    write_errors = {}
+    if documents:
+        try:
+            await database.allocations.insert_many(documents, ordered=False)
+        except BulkWriteError as bwe:
+            for write_error in bwe.details.get("writeErrors", []):
+                write_errors[write_error["index"]] = write_error
+
+    for position, (index, document) in enumerate(zip(document_indexes, documents)):
+        write_error = write_errors.get(position)
+        if write_error is None:
+            results[index] = BulkAllocationResult(
+                index=index, success=True, allocation_id=str(document["_id"]), status_code=200
+            )
+        elif write_error.get("code") == 11000:
+            results[index] = BulkAllocationResult(
+                index=index, success=False, status_code=400, detail="Vehicle already allocated for this date"
+            )
+        else:
+            results[index] = BulkAllocationResult(
+                index=index, success=False, status_code=500, detail=write_error.get("errmsg")
+            )
+
+    created_documents = [
+        document for position, document in enumerate(documents) if position not in write_errors
+    ]
+    for document in created_documents:
+        occupancy_index.apply(None, document)
+        change_feed.record(None, document)
+    if created_documents:
+        await history_cache.invalidate(
+            [document["employee_id"] for document in created_documents],
+            [document["vehicle_id"] for document in created_documents]
+        )
+
+    created = sum(1 for result in results if result.success)
+    return BulkAllocationResponse(created=created, failed=len(results) - created, results=results)
+
+
+@router.post("/allocations/series", response_model=AllocationSeriesResponse)
+async def create_allocation_series(series: AllocationSeriesCreate):
+    dates = series.dates()
+    if not dates:
+        raise HTTPException(status_code=400, detail="No dates in the range match the weekdays")
+
+    # Validate the references once for the whole series, as create_allocation does
+    employee, vehicle, driver = await asyncio.gather(
+        employee_cache.get(series.employee_id),
+        vehicle_cache.get(series.vehicle_id),
+        driver_cache.get(series.vehicle_id)
+    )
+    if not employee:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    if vehicle["status"] != "available":
+        raise HTTPException(status_code=400, detail="Vehicle not available")
+    if not driver:
+        raise HTTPException(status_code=404, detail="No driver assigned to vehicle")
+
+    allocation_dates = [datetime.combine(day, datetime.min.time()) for day in dates]
+
+    # Every date checked for an existing booking with one $in query
+    booked = set()
+    if series.status == "active":
+        conflicts = await database.allocations.find(
+            {"vehicle_id": series.vehicle_id, "status": "active", "allocation_date": {"$in": allocation_dates}},
+            {"_id": 0, "allocation_date": 1}
+        ).to_list(length=None)
+        booked = {conflict["allocation_date"] for conflict in conflicts}
+    if booked and series.mode == "all_or_nothing":
+        raise HTTPException(
+            status_code=400,
+            detail="Vehicle already allocated for: " + ", ".join(sorted(day.date().isoformat() for day in booked))
+        )
+
+    results = {}
+    documents = []
+    now = datetime.utcnow()
+    for allocation_date in allocation_dates:
+        if allocation_date in booked:
+            results[allocation_date] = AllocationSeriesResult(
+                allocation_date=allocation_date.date(), success=False, status_code=400,
+                detail="Vehicle already allocated for this date"
+            )
+            continue
+        documents.append({
+            "employee_id": series.employee_id,
+            "vehicle_id": series.vehicle_id,
+            "driver_id": driver["driver_id"],
+            "allocation_date": allocation_date,
+            "status": series.status,
+            "created_at": now,
+            "updated_at": now,
+            "employee_name": employee["name"],
+            "vehicle_name": vehicle["vehicle_name"],
+            "driver_name": driver.get("name")
+        })
+
+    # One unordered batch; the unique index still catches bookings made
+    # since the conflict check
+    write_errors = {}
+    if documents:
+        try:
+            await database.allocations.insert_many(documents, ordered=False)
+        except BulkWriteError as bwe:
+            for write_error in bwe.details.get("writeErrors", []):
+                write_errors[write_error["index"]] = write_error
+    created_documents = [document for position, document in enumerate(documents) if position not in write_errors]
+
+    if write_errors and series.mode == "all_or_nothing":
+        # Without a transaction, undo the days that did get in
+        if created_documents:
+            await database.allocations.delete_many({"_id": {"$in": [document["_id"] for document in created_documents]}})
+            # Pages cached while the days existed must not outlive them
+            await history_cache.invalidate([series.employee_id], [series.vehicle_id])
+        lost = [documents[position]["allocation_date"].date().isoformat() for position in sorted(write_errors)]
+        raise HTTPException(status_code=400, detail="Vehicle already allocated for: " + ", ".join(lost))
+
+    for position, document in enumerate(documents):
+        write_error = write_errors.get(position)
+        if write_error is None:
+            result = AllocationSeriesResult(
+                allocation_date=document["allocation_date"].date(), success=True,
+                allocation_id=str(document["_id"]), status_code=200
+            )
+        elif write_error.get("code") == 11000:
+            result = AllocationSeriesResult(
+                allocation_date=document["allocation_date"].date(), success=False, status_code=400,
+                detail="Vehicle already allocated for this date"
+            )
+        else:
+            result = AllocationSeriesResult(
+                allocation_date=document["allocation_date"].date(), success=False, status_code=500,
+                detail=write_error.get("errmsg")
+            )
+        results[document["allocation_date"]] = result
+
+    for document in created_documents:
+        occupancy_index.apply(None, document)
+        change_feed.record(None, document)
+    if created_documents:
+        await history_cache.invalidate([series.employee_id], [series.vehicle_id])
+
+    ordered_results = [results[allocation_date] for allocation_date in allocation_dates]
+    created = len(created_documents)
+    return AllocationSeriesResponse(created=created, failed=len(ordered_results) - created, results=ordered_results)
+
+
+async def fill_display_names(allocation):
+    # Only documents missing a denormalized name pay for the lookups
+    lookups = {}
+    if allocation.get("employee_name") is None:
+        lookups["employee_name"] = employee_cache.get(allocation["employee_id"])
+    if allocation.get("vehicle_name") is None:
+        lookups["vehicle_name"] = vehicle_cache.get(allocation["vehicle_id"])
+    if allocation.get("driver_name") is None and allocation.get("driver_id"):
+        lookups["driver_name"] = database.drivers.find_one({"driver_id": allocation["driver_id"]}, {"_id": 0, "name": 1})
+    if not lookups:
+        return allocation
+
+    documents = await asyncio.gather(*lookups.values())
+    for field, document in zip(lookups, documents):
+        if document:
+            allocation[field] = document["vehicle_name"] if field == "vehicle_name" else document["name"]
+    return allocation
+
+
+async def fill_page_display_names(allocations):
+    # Rows written before the names were denormalized (or by older
+    # instances during a deploy) get them from the reference caches, with
+    # one batched lookup per reference for the whole page
+    employee_ids = {allocation["employee_id"] for allocation in allocations if allocation.get("employee_name") is None}
+    vehicle_ids = {allocation["vehicle_id"] for allocation in allocations if allocation.get("vehicle_name") is None}
+    driver_ids = {
+        allocation["driver_id"] for allocation in allocations
+        if allocation.get("driver_name") is None and allocation.get("driver_id")
+    }
+    if not (employee_ids or vehicle_ids or driver_ids):
+        return allocations
+
+    async def no_drivers():
+        return []
+
+    employees, vehicles, drivers = await asyncio.gather(
+        employee_cache.get_many(list(employee_ids)),
+        vehicle_cache.get_many(list(vehicle_ids)),
+        database.drivers.find(
+            {"driver_id": {"$in": list(driver_ids)}}, {"_id": 0, "driver_id": 1, "name": 1}
+        ).to_list(length=None) if driver_ids else no_drivers()
+    )
+    driver_names = {driver["driver_id"]: driver.get("name") for driver in drivers}
+    for allocation in allocations:
+        # The schema requires both names; a deleted reference falls back to its id
+        if allocation.get("employee_name") is None:
+            employee = employees.get(allocation["employee_id"])
+            allocation["employee_name"] = employee["name"] if employee else allocation["employee_id"]
+        if allocation.get("vehicle_name") is None:
+            vehicle = vehicles.get(allocation["vehicle_id"])
+            allocation["vehicle_name"] = vehicle["vehicle_name"] if vehicle else allocation["vehicle_id"]
+        if allocation.get("driver_name") is None and allocation.get("driver_id"):
+            allocation["driver_name"] = driver_names.get(allocation["driver_id"])
+    return allocations
+
+
+async def allocation_exists(allocation_object_id):
+    # Either tier; archived allocations are past ones
+    live, archived = await asyncio.gather(
+        database.allocations.find_one({"_id": allocation_object_id}, {"_id": 1}),
+        database[ARCHIVE_COLLECTION].find_one({"_id": allocation_object_id}, {"_id": 1})
+    )
+    return bool(live or archived)
+
+
 @router.put("/allocations/{allocation_id}", response_model=AllocationResponse)
 async def update_allocation(allocation_id: str, allocation_update: AllocationUpdate):
     try:
@@ -74,47 +388,7 @@ async def update_allocation(allocation_id: str, allocation_update: AllocationUpd
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid allocation ID format")
 
-    # Fetch the existing allocation with joined data
-    pipeline = [
-        {"$match": {"_id": allocation_object_id}},
-        {
-            "$lookup": {
-                "from": "employees",
-                "localField": "employee_id",
-                "foreignField": "employee_id",
-                "as": "employee"
-            }
-        },
-        {
-            "$lookup": {
-                "from": "vehicles",
-                "localField": "vehicle_id",
-                "foreignField": "vehicle_id",
-                "as": "vehicle"
-            }
-        },
-        {
-            "$lookup": {
-                "from": "drivers",
-                "localField": "driver_id",
-                "foreignField": "driver_id",
-                "as": "driver"
-            }
-        }
-    ]
-
-    allocation_cursor = database.allocations.aggregate(pipeline)
-    allocation = await allocation_cursor.next()
-
-    if not allocation:
-        raise HTTPException(status_code=404, detail="Allocation not found")
-
-    # Check if the existing allocation date is in the past
     current_date = datetime.utcnow().date()
-    allocation_date = allocation["allocation_date"].date() if isinstance(allocation["allocation_date"], datetime) else allocation["allocation_date"]
-
-    if allocation_date < current_date:
-        raise HTTPException(status_code=400, detail="Cannot modify past allocations")
 
     # Build update document
     update_data = {"updated_at": datetime.utcnow()}
@@ -130,33 +404,40 @@ async def update_allocation(allocation_id: str, allocation_update: AllocationUpd
         # Convert date to datetime for storage
         new_allocation_date = datetime.combine(allocation_update.allocation_date, datetime.min.time())
 
-        # Check vehicle availability for new date
-        existing = await database.allocations.find_one({
-            "vehicle_id": allocation["vehicle_id"],
-            "allocation_date": new_allocation_date,
-            "status": "active",
-            "_id": {"$ne": allocation_object_id}
-        })
-
-        if existing:
-            raise HTTPException(
-                status_code=400,
-                detail="Vehicle already allocated for this date"
-            )
-
         update_data["allocation_date"] = new_allocation_date
 
-    # Update the allocation
-    result = await database.allocations.update_one(
-        {"_id": allocation_object_id},
-        {"$set": update_data}
-    )
+    # Update in one round trip, only if the allocation is not in the past.
+    # The previous version is returned so the in-process indexes can move
+    # the booking; the unique index rejects a date (or reactivation) that
+    # collides with another active allocation.
+    try:
+        allocation = await database.allocations.find_one_and_update(
+            {
+                "_id": allocation_object_id,
+                "allocation_date": {"$gte": datetime.combine(current_date, datetime.min.time())}
+            },
+            {"$set": update_data},
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=400,
+            detail="Vehicle already allocated for this date"
+        )
+
+    if not allocation:
+        # Tell a missing allocation from a past one only on the failure path
+        if not await allocation_exists(allocation_object_id):
+            raise HTTPException(status_code=404, detail="Allocation not found")
+        raise HTTPException(status_code=400, detail="Cannot modify past allocations")
 
-    if result.modified_count == 0:
-        raise HTTPException(status_code=400, detail="Update failed")
+    updated_allocation = {**allocation, **update_data}
+    await history_cache.invalidate([allocation["employee_id"]], [allocation["vehicle_id"]])
+    occupancy_index.apply(allocation, updated_allocation)
+    change_feed.record(allocation, updated_allocation)
 
-    # Fetch updated allocation with joined data
-    updated_allocation = await database.allocations.aggregate(pipeline).next()
+    # Allocations written before names were denormalized need a lookup
+    await fill_display_names(updated_allocation)
 
     # Prepare response
     response_data = {
@@ -168,11 +449,13 @@ async def update_allocation(allocation_id: str, allocation_update: AllocationUpd
         "status": updated_allocation["status"],
         "created_at": updated_allocation["created_at"],
         "updated_at": updated_allocation["updated_at"],
-        "employee_name": updated_allocation["employee"][0]["name"] if updated_allocation["employee"] else None,
-        "vehicle_name": updated_allocation["vehicle"][0]["vehicle_name"] if updated_allocation["vehicle"] else None,
-        "driver_name": updated_allocation["driver"][0]["name"] if updated_allocation["driver"] else None
+        "employee_name": updated_allocation.get("employee_name"),
+        "vehicle_name": updated_allocation.get("vehicle_name"),
+        "driver_name": updated_allocation.get("driver_name")
     }
 
+    if FAST_SERIALIZATION:
+        return FastJSONResponse(allocation_json(response_data))
     return AllocationResponse(**response_data)
 
 
@@ -187,6 +470,9 @@ async def delete_allocation(allocation_id: str):
     # Fetch the allocation
     allocation = await database.allocations.find_one({"_id": allocation_object_id})
     if not allocation:
+        # Archived allocations are past ones
+        if await database[ARCHIVE_COLLECTION].find_one({"_id": allocation_object_id}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="Cannot delete past allocations")
         raise HTTPException(status_code=404, detail="Allocation not found")
 
     # Check if the allocation date is in the past
@@ -199,26 +485,58 @@ async def delete_allocation(allocation_id: str):
 
     if result.deleted_count == 0:
         raise HTTPException(status_code=400, detail="Delete failed")
+    await history_cache.invalidate([allocation["employee_id"]], [allocation["vehicle_id"]])
+    occupancy_index.apply(allocation, None)
+    change_feed.record(allocation, None)
 
     return {"message": "Allocation deleted successfully", "allocation_id": str(allocation_object_id)}
 
 
-@router.get("/allocations/history", response_model=List[AllocationResponse])
-async def get_allocation_history(
-    start_date: Optional[date] = Query(None),
-    end_date: Optional[date] = Query(None),
-    employee_id: Optional[str] = Query(None),
-    vehicle_id: Optional[str] = Query(None),
-    status: Optional[str] = Query(None),
-    skip: int = Query(0, ge=0),
-    limit: int = Query(10, ge=1, le=100)
-):
+# Shapes each allocation for history and export; the display names are
+# denormalized onto the allocation, so no joins are needed
+HISTORY_PROJECTION = {
+    "$project": {
+        "allocation_id": {"$toString": "$_id"},
+        "employee_id": 1,
+        "vehicle_id": 1,
+        "driver_id": 1,
+        "allocation_date": 1,
+        "status": 1,
+        "created_at": 1,
+        "updated_at": 1,
+        "employee_name": 1,
+        "vehicle_name": 1,
+        "driver_name": 1
+    }
+}
+
+
+def encode_history_cursor(allocation):
+    # Opaque cursor built from the (allocation_date, _id) sort key
+    payload = json.dumps({"d": allocation["allocation_date"].isoformat(), "i": str(allocation["_id"])})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_history_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(payload["d"]), ObjectId(payload["i"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def build_history_query(start_date, end_date, employee_id, vehicle_id, status, cursor=None):
     # Initialize query dictionary
     query = {}
 
-    # Add date filters to the query if both are provided
-    if start_date and end_date:
-        query["allocation_date"] = {"$gte": start_date, "$lte": end_date}
+    # Add date filters to the query; dates are stored as midnight datetimes
+    date_range = {}
+    if start_date:
+        date_range["$gte"] = datetime.combine(start_date, datetime.min.time())
+    if end_date:
+        date_range["$lte"] = datetime.combine(end_date, datetime.min.time())
+    if date_range:
+        query["allocation_date"] = date_range
 
     # Add filters for employee_id, vehicle_id, and status
     if employee_id:
@@ -228,54 +546,615 @@ async def get_allocation_history(
     if status:
         query["status"] = status
 
-    # Use aggregation for efficient pagination and joining
-    pipeline = [
-        {"$match": query},
-        {"$sort": {"allocation_date": -1}},
-        {"$skip": skip},
-        {"$limit": limit},
-        {
-            "$lookup": {
-                "from": "employees",
-                "localField": "employee_id",
-                "foreignField": "employee_id",
-                "as": "employee"
-            }
-        },
-        {
-            "$lookup": {
-                "from": "vehicles",
-                "localField": "vehicle_id",
-                "foreignField": "vehicle_id",
-                "as": "vehicle"
-            }
-        },
-        {
-            "$lookup": {
-                "from": "drivers",
-                "localField": "driver_id",
-                "foreignField": "driver_id",
-                "as": "driver"
+    # Resume strictly after the last row of the previous page
+    if cursor:
+        keyset = history_keyset(cursor)
+        query = {"$and": [query, keyset]} if query else keyset
+
+    return query
+
+
+def history_keyset(cursor):
+    cursor_date, cursor_id = decode_history_cursor(cursor)
+    return {"$or": [
+        {"allocation_date": {"$lt": cursor_date}},
+        {"allocation_date": cursor_date, "_id": {"$lt": cursor_id}}
+    ]}
+
+
+# Vehicles listed in the by_vehicle counts, busiest first
+HISTORY_META_VEHICLES = 100
+
+
+async def fetch_history_with_meta(query, cursor, skip, limit, archive):
+    # One aggregation returns the page and the counts: the filter runs once
+    # and $facet splits the matched rows into the page, the total and the
+    # per-status and per-vehicle counts. The keyset cursor only narrows the page.
+    sort = {"$sort": {"allocation_date": -1, "_id": -1}}
+    pipeline = [{"$match": query}, sort]
+    if archive:
+        pipeline += [{"$unionWith": {"coll": ARCHIVE_COLLECTION, "pipeline": [{"$match": query}]}}, sort]
+    items = [{"$match": history_keyset(cursor)}] if cursor else []
+    if skip:
+        items.append({"$skip": skip})
+    items += [{"$limit": limit}, HISTORY_PROJECTION]
+    pipeline.append({"$facet": {
+        "items": items,
+        "total": [{"$count": "count"}],
+        "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+        "by_vehicle": [
+            {"$group": {"_id": "$vehicle_id", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": HISTORY_META_VEHICLES}
+        ]
+    }})
+    result = (await database.allocations.aggregate(pipeline, allowDiskUse=True).to_list(length=1))[0]
+    meta = {
+        "total": result["total"][0]["count"] if result["total"] else 0,
+        "estimated": False,
+        "by_status": {group["_id"]: group["count"] for group in result["by_status"]},
+        "by_vehicle": {group["_id"]: group["count"] for group in result["by_vehicle"]}
+    }
+    return result["items"], meta
+
+
+async def estimated_history_total(archive):
+    # Unfiltered totals come from collection metadata instead of a full count
+    counts = [database.allocations.estimated_document_count()]
+    if archive:
+        counts.append(database[ARCHIVE_COLLECTION].estimated_document_count())
+    return {"total": sum(await asyncio.gather(*counts)), "estimated": True, "by_status": None, "by_vehicle": None}
+
+
+@router.get("/allocations/history", response_model=Union[List[AllocationResponse], HistoryPage])
+async def get_allocation_history(
+    response: Response,
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    employee_id: Optional[str] = Query(None),
+    vehicle_id: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    include_meta: bool = Query(False, description="Wrap the page as {items, meta} with the total and per-status and per-vehicle counts")
+):
+    # Serve repeated filter combinations from the page cache
+    params = {
+        "start_date": start_date, "end_date": end_date, "employee_id": employee_id,
+        "vehicle_id": vehicle_id, "status": status, "skip": skip, "limit": limit, "cursor": cursor,
+        "include_meta": include_meta
+    }
+    cache_key, page = await history_cache.get(params)
+    if page is not None:
+        content = {"items": page["items"], "meta": page["meta"]} if include_meta else page["items"]
+        if FAST_SERIALIZATION:
+            headers = {"X-Next-Cursor": page["next_cursor"]} if page["next_cursor"] else None
+            return FastJSONResponse(content, headers=headers)
+        if page["next_cursor"]:
+            response.headers["X-Next-Cursor"] = page["next_cursor"]
+        return content
+
+    archive = reaches_archive(start_date)
+    filtered = any(value is not None for value in (start_date, end_date, employee_id, vehicle_id, status))
+    meta = None
+    if include_meta and filtered:
+        allocation_list, meta = await fetch_history_with_meta(
+            build_history_query(start_date, end_date, employee_id, vehicle_id, status), cursor, skip, limit, archive
+        )
+    else:
+        query = build_history_query(start_date, end_date, employee_id, vehicle_id, status, cursor)
+
+        # Use aggregation for efficient pagination; _id breaks
+        # ties so the keyset cursor is stable
+        sort = {"$sort": {"allocation_date": -1, "_id": -1}}
+        pipeline = [{"$match": query}, sort]
+        if archive:
+            # Each tier is cut to skip + limit rows on its own index before the
+            # merge, so reaching into the archive costs two bounded scans
+            pipeline.append({"$limit": skip + limit})
+            pipeline += [{"$unionWith": {"coll": ARCHIVE_COLLECTION, "pipeline": list(pipeline)}}, sort]
+        if skip:
+            pipeline.append({"$skip": skip})
+        pipeline += [{"$limit": limit}, HISTORY_PROJECTION]
+
+        allocation_cursor = database.allocations.aggregate(pipeline)
+        if include_meta:
+            allocation_list, meta = await asyncio.gather(
+                allocation_cursor.to_list(length=limit), estimated_history_total(archive)
+            )
+        else:
+            allocation_list = await allocation_cursor.to_list(length=limit)
+
+    await fill_page_display_names(allocation_list)
+
+    # A full page means there may be more rows after it
+    next_cursor = None
+    if len(allocation_list) == limit:
+        next_cursor = encode_history_cursor(allocation_list[-1])
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    # The projection already matches the schema: encode it directly rather
+    # than building and then re-validating 100 models per page
+    if FAST_SERIALIZATION:
+        items = [allocation_json(allocation) for allocation in allocation_list]
+        await history_cache.set(cache_key, {"items": items, "next_cursor": next_cursor, "meta": meta})
+        content = {"items": items, "meta": meta} if include_meta else items
+        return FastJSONResponse(content, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+    items = [AllocationResponse(**allocation) for allocation in allocation_list]
+    await history_cache.set(cache_key, {"items": jsonable_encoder(items), "next_cursor": next_cursor, "meta": meta})
+    if include_meta:
+        return HistoryPage(items=items, meta=HistoryMeta(**meta))
+    return items
+
+
+def sse_event(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {dumps(data).decode()}\n\n"
+
+
+async def stream_changes(subscriber, backlog, last_event_id=None):
+    # Ids sent while catching up, which the live queue may repeat
+    replayed = set()
+    try:
+        # Clients reconnect after 3s and send Last-Event-ID to resume
+        yield "retry: 3000\n\n"
+        if backlog is None and change_feed.can_replay(last_event_id):
+            # A change stream token from before a restart or from another worker
+            try:
+                async for event_id, event in change_feed.replay(subscriber, last_event_id):
+                    replayed.add(event_id)
+                    yield sse_event(event_id, event["operation"], event)
+                backlog = []
+            except PyMongoError as e:
+                logger.warning("Change feed replay from %s failed: %s", last_event_id, e)
+        if backlog is None:
+            # Too far behind for the buffer: the client should reload from /allocations/history
+            yield f"event: reset\ndata: {dumps({'detail': 'Last-Event-ID is no longer available'}).decode()}\n\n"
+            backlog = []
+        for event_id, event in backlog:
+            yield sse_event(event_id, event["operation"], event)
+        while True:
+            try:
+                event_id, event = await asyncio.wait_for(subscriber.queue.get(), CHANGE_FEED_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if subscriber.overflowed:
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            if event_id not in replayed:
+                yield sse_event(event_id, event["operation"], event)
+            if subscriber.overflowed and subscriber.queue.empty():
+                break
+        # Cut off for falling behind; reconnecting with the last id resumes from the buffer
+        yield f"event: overflow\ndata: {dumps({'detail': 'Consumer too slow, reconnect to resume'}).decode()}\n\n"
+    finally:
+        change_feed.unsubscribe(subscriber)
+
+
+@router.get("/allocations/stream")
+async def stream_allocation_changes(
+    request: Request,
+    employee_id: Optional[str] = Query(None),
+    vehicle_id: Optional[str] = Query(None),
+    last_event_id: Optional[str] = Query(None, description="Resume after this event id (or send the Last-Event-ID header)")
+):
+    # Server-sent events for allocation creates, updates and deletes
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    subscriber, backlog = change_feed.subscribe(employee_id, vehicle_id, last_event_id)
+    return StreamingResponse(
+        stream_changes(subscriber, backlog, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+EXPORT_FIELDS = [
+    "allocation_id", "employee_id", "employee_name", "vehicle_id", "vehicle_name",
+    "driver_id", "driver_name", "allocation_date", "status", "created_at", "updated_at"
+]
+
+
+def export_row(allocation):
+    row = {}
+    for field in EXPORT_FIELDS:
+        value = allocation.get(field)
+        row[field] = value.isoformat() if isinstance(value, datetime) else value
+    return row
+
+
+async def export_batches(allocation_cursor, batch_size):
+    batch = []
+    async for allocation in allocation_cursor:
+        batch.append(allocation)
+        if len(batch) == batch_size:
+            yield await fill_page_display_names(batch)
+            batch = []
+    if batch:
+        yield await fill_page_display_names(batch)
+
+
+async def merge_tiers(cursors):
+    # Each tier comes back in index order, newest first; merging the heads
+    # keeps that order without a blocking server-side sort of both tiers
+    heads = []
+    for cursor in cursors:
+        iterator = aiter(cursor)
+        head = await anext(iterator, None)
+        if head is not None:
+            heads.append([head, iterator])
+    while heads:
+        newest = max(heads, key=lambda entry: (entry[0]["allocation_date"], entry[0]["allocation_id"]))
+        yield newest[0]
+        newest[0] = await anext(newest[1], None)
+        if newest[0] is None:
+            heads.remove(newest)
+
+
+async def stream_export(pipeline, export_format, batch_size, archive=False):
+    collections = ["allocations", ARCHIVE_COLLECTION] if archive else ["allocations"]
+    allocation_cursor = merge_tiers([
+        database[collection].aggregate(pipeline, batchSize=batch_size) for collection in collections
+    ])
+
+    if export_format == "csv":
+        # Send the header straight away, then one chunk per cursor batch
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        yield buffer.getvalue()
+        async for batch in export_batches(allocation_cursor, batch_size):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(export_row(allocation) for allocation in batch)
+            yield buffer.getvalue()
+        return
+
+    async for batch in export_batches(allocation_cursor, batch_size):
+        yield "\n".join(dumps(export_row(allocation)).decode() for allocation in batch) + "\n"
+
+
+@router.get("/allocations/export")
+async def export_allocation_history(
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    employee_id: Optional[str] = Query(None),
+    vehicle_id: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    batch_size: int = Query(1000, ge=1, le=10000)
+):
+    query = build_history_query(start_date, end_date, employee_id, vehicle_id, status)
+
+    # Stream straight from index-ordered cursors so memory stays flat;
+    # the archive tier gets its own cursor rather than a $unionWith
+    pipeline = [{"$match": query}, {"$sort": {"allocation_date": -1, "_id": -1}}, HISTORY_PROJECTION]
+
+    if format == "csv":
+        media_type = "text/csv"
+        filename = "allocations.csv"
+    else:
+        media_type = "application/x-ndjson"
+        filename = "allocations.ndjson"
+
+    return StreamingResponse(
+        stream_export(pipeline, format, batch_size, reaches_archive(start_date)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+async def propagate_name(key_field, key, name_field, name):
+    # Only rows that still carry another name are rewritten
+    results = await asyncio.gather(*[
+        database[allocations].update_many(
+            {key_field: key, name_field: {"$ne": name}},
+            {"$set": {name_field: name}}
+        )
+        for allocations in ("allocations", ARCHIVE_COLLECTION)
+    ])
+    return sum(result.modified_count for result in results)
+
+
+async def rename_reference(collection, key_field, key, name_field, allocation_key_field, allocation_name_field, name):
+    # Rename the reference record, then copy the new name onto its allocations
+    document = await database[collection].find_one_and_update(
+        {key_field: key},
+        {"$set": {name_field: name}},
+        projection={"_id": 0}
+    )
+    if not document:
+        return None, 0
+    propagated = await propagate_name(allocation_key_field, key, allocation_name_field, name)
+    sweep = asyncio.create_task(sweep_renamed_allocations(
+        collection, key_field, key, name_field, allocation_key_field, allocation_name_field, name
+    ))
+    rename_sweeps.add(sweep)
+    sweep.add_done_callback(rename_sweeps.discard)
+    return document, propagated
+
+
+# Other workers read names through their local reference caches, so they may
+# write the old name onto new allocations for up to LOCAL_CACHE_TTL after a
+# rename; one more pass once those entries have expired rewrites them
+RENAME_SWEEP_DELAY = LOCAL_CACHE_TTL + 1
+rename_sweeps = set()
+
+
+async def sweep_renamed_allocations(collection, key_field, key, name_field, allocation_key_field, allocation_name_field, name):
+    await asyncio.sleep(RENAME_SWEEP_DELAY)
+    try:
+        # A later rename runs its own sweep
+        document = await database[collection].find_one({key_field: key}, {"_id": 0, name_field: 1})
+        if not document or document.get(name_field) != name:
+            return
+        modified = await propagate_name(allocation_key_field, key, allocation_name_field, name)
+        if modified:
+            logger.info("Rewrote %s on %d allocations booked during the rename of %s", allocation_name_field, modified, key)
+            await history_cache.invalidate(everything=True)
+    except Exception as e:
+        logger.error("Rename sweep for %s %s failed: %s", collection, key, e)
+
+
+@router.patch("/employees/{employee_id}", response_model=dict)
+async def update_employee(employee_id: str, employee_update: EmployeeUpdate):
+    employee, propagated = await rename_reference(
+        "employees", "employee_id", employee_id, "name",
+        "employee_id", "employee_name", employee_update.name
+    )
+    if not employee:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    await employee_cache.invalidate(employee_id)
+    # The name also shows on pages filtered by vehicle or status only
+    await history_cache.invalidate(everything=True)
+    return {"message": "Employee updated successfully", "employee_id": employee_id, "allocations_updated": propagated}
+
+
+@router.get("/vehicles/available", response_model=dict)
+async def get_available_vehicles(
+    start: date = Query(...),
+    end: Optional[date] = Query(None)
+):
+    end = end or start
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    if (end - start).days > MAX_AVAILABILITY_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range cannot exceed {MAX_AVAILABILITY_DAYS} days")
+    if start < date.today():
+        raise HTTPException(status_code=400, detail="Cannot check availability for past dates")
+
+    # Answered from the in-process occupancy bitmap, no database access;
+    # before it has loaded, an empty answer would mean "nothing free"
+    if occupancy_index.loaded_at is None:
+        raise HTTPException(status_code=503, detail="Occupancy index is still loading, retry later")
+    vehicle_ids = occupancy_index.available(start, end)
+    return {"start": start, "end": end, "count": len(vehicle_ids), "vehicle_ids": vehicle_ids}
+
+
+@router.patch("/vehicles/{vehicle_id}", response_model=dict)
+async def update_vehicle(vehicle_id: str, vehicle_update: VehicleUpdate):
+    vehicle, propagated = await rename_reference(
+        "vehicles", "vehicle_id", vehicle_id, "vehicle_name",
+        "vehicle_id", "vehicle_name", vehicle_update.vehicle_name
+    )
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    await vehicle_cache.invalidate(vehicle_id)
+    # The name also shows on pages filtered by employee or status only
+    await history_cache.invalidate(everything=True)
+    return {"message": "Vehicle updated successfully", "vehicle_id": vehicle_id, "allocations_updated": propagated}
+
+
+async def pick_replacement_vehicles(allocations, pool=None):
+    # Picks a free vehicle with a driver for each allocation, from the
+    # occupancy index rather than per-date queries. Returns
+    # {allocation _id: (vehicle, driver)}; allocations left out have no free vehicle.
+    allowed = set(pool) if pool is not None else None
+    unusable = set()
+    while True:
+        picks = {}
+        taken = {}
+        for allocation in allocations:
+            day = allocation["allocation_date"].date()
+            taken_today = taken.setdefault(day, set())
+            for candidate in occupancy_index.available(day, day):
+                if candidate in unusable or candidate in taken_today:
+                    continue
+                if allowed is not None and candidate not in allowed:
+                    continue
+                picks[allocation["_id"]] = candidate
+                taken_today.add(candidate)
+                break
+
+        vehicle_ids = list(set(picks.values()))
+        vehicles, drivers = await asyncio.gather(
+            vehicle_cache.get_many(vehicle_ids),
+            driver_cache.get_many(vehicle_ids)
+        )
+        # A vehicle without a driver cannot take a booking; pick again without it
+        missing = {vehicle_id for vehicle_id in vehicle_ids if vehicle_id not in vehicles or vehicle_id not in drivers}
+        if not missing:
+            return {
+                allocation_id: (vehicles[vehicle_id], drivers[vehicle_id])
+                for allocation_id, vehicle_id in picks.items()
             }
-        },
-        {
-            "$project": {
-                "allocation_id": {"$toString": "$_id"},
-                "employee_id": 1,
-                "vehicle_id": 1,
-                "driver_id": 1,
-                "allocation_date": 1,
-                "status": 1,
-                "created_at": 1,
-                "updated_at": 1,
-                "employee_name": {"$arrayElemAt": ["$employee.name", 0]},
-                "vehicle_name": {"$arrayElemAt": ["$vehicle.vehicle_name", 0]},
-                "driver_name": {"$arrayElemAt": ["$driver.name", 0]}
+        unusable |= missing
+
+
+@router.patch("/vehicles/{vehicle_id}/status", response_model=dict)
+async def update_vehicle_status(vehicle_id: str, status_update: VehicleStatusUpdate):
+    if status_update.action == "reassign" and occupancy_index.loaded_at is None:
+        raise HTTPException(status_code=503, detail="Occupancy index is still loading, retry later")
+
+    vehicle = await database.vehicles.find_one_and_update(
+        {"vehicle_id": vehicle_id},
+        {"$set": {"status": status_update.status}},
+        projection={"_id": 0, "status": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    await vehicle_cache.invalidate(vehicle_id)
+    occupancy_index.set_vehicle_status(vehicle_id, status_update.status)
+
+    summary = {
+        "vehicle_id": vehicle_id,
+        "status": status_update.status,
+        "previous_status": vehicle.get("status"),
+        "allocations_cancelled": 0,
+        "allocations_reassigned": 0,
+        "allocations_skipped": 0,
+        "cancelled": [],
+        "reassigned": [],
+        "skipped": []
+    }
+    if status_update.status == "available":
+        return summary
+
+    summary.update(await cascade_vehicle_allocations(vehicle_id, status_update.action, status_update.pool))
+    sweep = asyncio.create_task(sweep_vehicle_allocations(
+        vehicle_id, status_update.status, status_update.action, status_update.pool
+    ))
+    status_sweeps.add(sweep)
+    sweep.add_done_callback(status_sweeps.discard)
+    return summary
+
+
+async def cascade_vehicle_allocations(vehicle_id, action, pool=None):
+    # Future bookings (today included) on a vehicle leaving service
+    today = datetime.combine(date.today(), datetime.min.time())
+    allocations = await database.allocations.find(
+        {"vehicle_id": vehicle_id, "status": "active", "allocation_date": {"$gte": today}}
+    ).to_list(length=None)
+    result = {"cancelled": [], "reassigned": [], "skipped": []}
+    if allocations:
+        targets = {}
+        if action == "reassign":
+            targets = await pick_replacement_vehicles(allocations, pool)
+        await apply_vehicle_cascade(vehicle_id, allocations, targets, result)
+    for name in ("cancelled", "reassigned", "skipped"):
+        result[f"allocations_{name}"] = len(result[name])
+    return result
+
+
+async def apply_vehicle_cascade(vehicle_id, allocations, targets, result):
+    # Every cancellation and reassignment goes out in one bulk_write; the
+    # filter skips allocations changed since they were read. MongoDB keeps
+    # milliseconds, and now is matched again below
+    now = datetime.utcnow()
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    operations = []
+    changes = []
+    for allocation in allocations:
+        target = targets.get(allocation["_id"])
+        if target is not None:
+            new_vehicle, driver = target
+            fields = {
+                "vehicle_id": new_vehicle["vehicle_id"],
+                "vehicle_name": new_vehicle["vehicle_name"],
+                "driver_id": driver["driver_id"],
+                "driver_name": driver.get("name"),
+                "updated_at": now
             }
-        }
-    ]
+        else:
+            fields = {"status": "cancelled", "updated_at": now}
+        operations.append(UpdateOne(
+            {"_id": allocation["_id"], "vehicle_id": vehicle_id, "status": "active"}, {"$set": fields}
+        ))
+        changes.append((allocation, {**allocation, **fields}))
+
+    conflicts = []
+    try:
+        matched = (await database.allocations.bulk_write(operations, ordered=False)).matched_count
+    except BulkWriteError as bwe:
+        conflicts = [error["index"] for error in bwe.details.get("writeErrors", []) if error.get("code") == 11000]
+        if len(conflicts) != len(bwe.details.get("writeErrors", [])):
+            raise HTTPException(status_code=500, detail="Failed to update allocations")
+        matched = bwe.details.get("nMatched", 0)
+    if conflicts:
+        # The picked vehicle was booked by another process in the meantime: cancel instead
+        fallback = await database.allocations.update_many(
+            {"_id": {"$in": [allocations[index]["_id"] for index in conflicts]}, "vehicle_id": vehicle_id, "status": "active"},
+            {"$set": {"status": "cancelled", "updated_at": now}}
+        )
+        matched += fallback.matched_count
+        for index in conflicts:
+            changes[index] = (allocations[index], {**allocations[index], "status": "cancelled", "updated_at": now})
+
+    applied = None
+    if matched < len(allocations):
+        # Some allocations were cancelled or moved after the find: only the
+        # ones stamped by this cascade changed
+        stamped = await database.allocations.find(
+            {"_id": {"$in": [allocation["_id"] for allocation in allocations]}, "updated_at": now}, {"_id": 1}
+        ).to_list(length=None)
+        applied = {document["_id"] for document in stamped}
+
+    for before, after in changes:
+        if applied is not None and after["_id"] not in applied:
+            result["skipped"].append(str(after["_id"]))
+            continue
+        occupancy_index.apply(before, after)
+        change_feed.record(before, after)
+        if after["status"] == "cancelled":
+            result["cancelled"].append(str(after["_id"]))
+        else:
+            result["reassigned"].append({
+                "allocation_id": str(after["_id"]),
+                "allocation_date": after["allocation_date"].date(),
+                "vehicle_id": after["vehicle_id"]
+            })
+
+    await history_cache.invalidate(
+        [allocation["employee_id"] for allocation in allocations],
+        [vehicle_id] + [after["vehicle_id"] for _, after in changes]
+    )
+
+
+# Other workers check the vehicle status through their local cache, so they
+# may book the vehicle for up to LOCAL_CACHE_TTL after the change; one more
+# cascade once those entries have expired catches these bookings
+STATUS_SWEEP_DELAY = LOCAL_CACHE_TTL + 1
+status_sweeps = set()
+
+
+async def sweep_vehicle_allocations(vehicle_id, status, action, pool):
+    await asyncio.sleep(STATUS_SWEEP_DELAY)
+    try:
+        vehicle = await database.vehicles.find_one({"vehicle_id": vehicle_id}, {"_id": 0, "status": 1})
+        if not vehicle or vehicle.get("status") != status:
+            return
+        result = await cascade_vehicle_allocations(vehicle_id, action, pool)
+        if result["allocations_cancelled"] or result["allocations_reassigned"]:
+            logger.info(
+                "Late bookings on %s vehicle %s: %d cancelled, %d reassigned", status, vehicle_id,
+                result["allocations_cancelled"], result["allocations_reassigned"]
+            )
+    except Exception as e:
+        logger.error("Status sweep for vehicle %s failed: %s", vehicle_id, e)
+
+
+@router.patch("/drivers/{driver_id}", response_model=dict)
+async def update_driver(driver_id: str, driver_update: DriverUpdate):
+    driver, propagated = await rename_reference(
+        "drivers", "driver_id", driver_id, "name",
+        "driver_id", "driver_name", driver_update.name
+    )
+    if not driver:
+        raise HTTPException(status_code=404, detail="Driver not found")
+    # The driver cache is keyed by the vehicle the driver is assigned to
+    if driver.get("assigned_vehicle_id"):
+        await driver_cache.invalidate(driver["assigned_vehicle_id"])
+    # Past allocations may carry this driver on any vehicle
+    await history_cache.invalidate(everything=True)
+    return {"message": "Driver updated successfully", "driver_id": driver_id, "allocations_updated": propagated}
+
+
+@router.get("/cache/stats", response_model=dict)
+async def get_cache_stats():
+    return cache_stats()
 
-    allocation_cursor = database.allocations.aggregate(pipeline)
-    allocation_list = await allocation_cursor.to_list(length=limit)
 
-    return [AllocationResponse(**allocation) for allocation in allocation_list]
+@router.get("/admin/queries", response_model=dict)
+async def get_query_stats():
+    return query_monitor.report()
@@ -0,0 +1,41 @@
+import json
+from datetime import datetime, date
+from fastapi.responses import Response
+from models.models import AllocationResponse
+
+# orjson is optional; without it the fast path still skips re-validation
+# and falls back to the stdlib encoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Field order of the documented schema, so both paths emit identical JSON
+ALLOCATION_FIELDS = list(AllocationResponse.model_fields)
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(content):
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, separators=(",", ":")).encode()
+
+
+# Renders already-shaped content as-is. Returning a Response skips the
+# response_model pass while the route keeps its documented schema.
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
+
+
+# An allocation document (aggregation output or a stored document with
+# allocation_id set) in AllocationResponse shape, without building the model
+def allocation_json(document):
+    return {field: document.get(field) for field in ALLOCATION_FIELDS}
@@ -0,0 +1,93 @@
+import os
+import sys
+import logging
+import argparse
+import importlib.util
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("serve")
+
+
+def default_workers():
+    # One per core, but only with a shared store: without REDIS_URL every
+    # worker has its own cache generations, idempotency records and change
+    # feed, so writes on one worker go unseen by the others
+    if os.getenv("WEB_CONCURRENCY"):
+        return int(os.getenv("WEB_CONCURRENCY"))
+    return (os.cpu_count() or 1) if os.getenv("REDIS_URL") else 1
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the API with one Motor client per worker process")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Worker processes (WEB_CONCURRENCY; more than one requires REDIS_URL)")
+    parser.add_argument(
+        "--total-pool-size", type=int,
+        default=int(os.getenv("MONGODB_TOTAL_POOL_SIZE", os.getenv("MONGODB_MAX_POOL_SIZE", "100"))),
+        help="MongoDB connections this server may open across all workers (MONGODB_TOTAL_POOL_SIZE)"
+    )
+    parser.add_argument(
+        "--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30")),
+        help="Seconds to let in-flight requests finish after SIGTERM"
+    )
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("KEEP_ALIVE_SECONDS", "5")))
+    parser.add_argument("--access-log", action="store_true", help="Log every request (off by default: /metrics covers it)")
+    return parser.parse_args(argv)
+
+
+# Split the connection budget so workers x maxPoolSize stays within it
+def per_worker_pool(total, workers, min_pool_size):
+    max_pool_size = max(1, total // workers)
+    return max_pool_size, min(min_pool_size, max_pool_size)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    workers = max(1, args.workers)
+    if workers > 1 and not os.getenv("REDIS_URL"):
+        logger.error(
+            "%d workers need REDIS_URL: history cache invalidation, Idempotency-Key replays "
+            "and the local change feed are shared through it. Set REDIS_URL or run one worker", workers
+        )
+        return 2
+
+    # Workers are spawned and read their pool size from the environment when
+    # config is imported, so each one builds its own client with its share
+    max_pool_size, min_pool_size = per_worker_pool(
+        args.total_pool_size, workers, int(os.getenv("MONGODB_MIN_POOL_SIZE", "10"))
+    )
+    os.environ["MONGODB_MAX_POOL_SIZE"] = str(max_pool_size)
+    os.environ["MONGODB_MIN_POOL_SIZE"] = str(min_pool_size)
+
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    logger.info(
+        "Starting %d worker(s) on %s:%d with %s/%s, MongoDB pool %d-%d per worker (%d total)",
+        workers, args.host, args.port, loop, http, min_pool_size, max_pool_size, max_pool_size * workers
+    )
+
+    # On SIGTERM uvicorn stops accepting connections, waits up to the graceful
+    # timeout for in-flight requests, then runs the lifespan shutdown that
+    # closes the pool
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_keep_alive=args.keep_alive,
+        proxy_headers=True,
+        access_log=args.access_log,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import os
+import sys
+from datetime import datetime, date, timedelta
+
+import httpx
+import pytest_asyncio
+
+# The app modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import config
+import idempotency
+from indexes import sync_indexes
+from memorydb import MemoryClient
+from occupancy import occupancy_index
+
+
+def tomorrow(days=1):
+    return date.today() + timedelta(days=days)
+
+
+# A fresh in-memory database and cold caches for every test. Reference data
+# is written straight to the database, so the first request pays for its
+# lookups exactly as it would after a deploy.
+@pytest_asyncio.fixture
+async def memory_client(monkeypatch):
+    client = MemoryClient()
+    config.mongo.use(client, "vehicle_allocation_test")
+    store = cache.MemoryRedis()
+    monkeypatch.setattr(cache, "shared_store", store)
+    monkeypatch.setattr(idempotency, "shared_store", store)
+    for reference_cache in (cache.employee_cache, cache.vehicle_cache, cache.driver_cache):
+        reference_cache.local.clear()
+    cache.history_cache.local.clear()
+    occupancy_index.__init__()
+
+    # The unique (vehicle, date) index is what turns double bookings into 400s
+    await sync_indexes()
+    database = config.database
+    await database.employees.insert_one({"employee_id": "EMP001", "name": "John Doe"})
+    await database.vehicles.insert_many([
+        {"vehicle_id": "VEH001", "vehicle_name": "Toyota Camry", "status": "available"},
+        {"vehicle_id": "VEH002", "vehicle_name": "Honda Civic", "status": "available"}
+    ])
+    await database.drivers.insert_many([
+        {"driver_id": "DRV001", "name": "Mike Smith", "assigned_vehicle_id": "VEH001"},
+        {"driver_id": "DRV002", "name": "Jane Roe", "assigned_vehicle_id": "VEH002"}
+    ])
+    await database.allocations.insert_one({
+        "employee_id": "EMP001",
+        "vehicle_id": "VEH002",
+        "driver_id": "DRV002",
+        "allocation_date": datetime.combine(tomorrow(), datetime.min.time()),
+        "status": "active",
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+        "employee_name": "John Doe",
+        "vehicle_name": "Honda Civic",
+        "driver_name": "Jane Roe"
+    })
+    client.calls.clear()
+    yield client
+    config.mongo.close()
+
+
+@pytest_asyncio.fixture
+async def api(memory_client):
+    from main import app
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http_client:
+        yield http_client
@@ -0,0 +1,18 @@
+from datetime import datetime
+
+import pytest
+
+import config
+
+
+@pytest.mark.asyncio
+async def test_archived_allocations_cannot_be_changed(api, memory_client):
+    result = await config.database.allocations_archive.insert_one({
+        "employee_id": "EMP001", "vehicle_id": "VEH001", "allocation_date": datetime(2020, 1, 1), "status": "completed"
+    })
+    allocation_id = str(result.inserted_id)
+
+    response = await api.put(f"/api/allocations/{allocation_id}", json={"status": "cancelled"})
+    assert (response.status_code, response.json()["detail"]) == (400, "Cannot modify past allocations")
+    response = await api.delete(f"/api/allocations/{allocation_id}")
+    assert (response.status_code, response.json()["detail"]) == (400, "Cannot delete past allocations")
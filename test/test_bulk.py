@@ -0,0 +1,16 @@
+import pytest
+from conftest import tomorrow
+
+
+@pytest.mark.asyncio
+async def test_past_date_fails_only_its_item(api, memory_client):
+    response = await api.post("/api/allocations/bulk", json={"allocations": [
+        {"employee_id": "EMP001", "vehicle_id": "VEH001", "allocation_date": tomorrow(-2).isoformat()},
+        {"employee_id": "EMP001", "vehicle_id": "VEH001", "allocation_date": tomorrow(2).isoformat()}
+    ]})
+    assert response.status_code == 200, response.text
+    page = response.json()
+    assert (page["created"], page["failed"]) == (1, 1)
+    assert page["results"][0]["status_code"] == 400
+    assert page["results"][0]["detail"] == "Cannot allocate vehicle for past dates"
+    assert page["results"][1]["success"]
@@ -0,0 +1,123 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+import changefeed
+import config
+from archive import archive_allocations
+from changefeed import ChangeFeed, allocation_event
+
+
+def change(operation, document_id, token, **fields):
+    return {"_id": {"_data": token}, "operationType": operation, "documentKey": {"_id": document_id}, **fields}
+
+
+@pytest.mark.asyncio
+async def test_archive_deletes_are_not_published(memory_client):
+    feed = ChangeFeed()
+    subscriber, _ = feed.subscribe()
+    archived, deleted = ObjectId(), ObjectId()
+
+    feed._publish_change(change("update", archived, "1", updateDescription={"updatedFields": {"archived_at": datetime.utcnow()}}))
+    feed._publish_change(change("delete", archived, "2"))
+    feed._publish_change(change("delete", deleted, "3"))
+
+    assert subscriber.queue.qsize() == 1
+    event_id, event = subscriber.queue.get_nowait()
+    assert (event_id, event["operation"], event["allocation_id"]) == ("3", "delete", str(deleted))
+
+
+@pytest.mark.asyncio
+async def test_archive_marks_rows_before_deleting(memory_client):
+    database = config.database
+    await database.allocations.update_many({}, {"$set": {"allocation_date": datetime(2000, 1, 1)}})
+    memory_client.calls.clear()
+
+    assert await archive_allocations() == 1
+    operations = [operation for collection, operation in memory_client.calls if collection == "allocations"]
+    assert operations.index("update_many") < operations.index("delete_many")
+    archived = await database.allocations_archive.find_one({})
+    assert "archived_at" not in archived
+
+
+class FakeChangeStream:
+    def __init__(self, changes):
+        self.changes = list(changes)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def try_next(self):
+        return self.changes.pop(0) if self.changes else None
+
+
+@pytest.mark.asyncio
+async def test_resume_from_token_not_in_buffer(memory_client, monkeypatch):
+    import routes.routes as routes
+    feed = ChangeFeed()
+    feed.mode = "change_stream"
+    monkeypatch.setattr(routes, "change_feed", feed)
+    monkeypatch.setattr(routes, "CHANGE_FEED_KEEPALIVE_SECONDS", 0.01)
+    document = await config.database.allocations.find_one({})
+    opened = {}
+
+    def watch(**options):
+        opened.update(options)
+        return FakeChangeStream([
+            change("insert", document["_id"], "82B", fullDocument=document),
+            change("insert", document["_id"], "82C", fullDocument={**document, "employee_id": "EMP999"}),
+        ])
+
+    monkeypatch.setattr(config.database.allocations, "watch", watch)
+    subscriber, backlog = feed.subscribe(employee_id="EMP001", last_event_id="82A")
+    assert backlog is None
+    # The live feed delivers 82B again once the subscriber has caught up
+    feed.publish("82B", allocation_event("insert", document))
+
+    stream = routes.stream_changes(subscriber, backlog, "82A")
+    assert await anext(stream) == "retry: 3000\n\n"
+    assert (await anext(stream)).startswith("id: 82B\nevent: insert\n")
+    assert opened["resume_after"] == {"_data": "82A"}
+    # 82C is for another employee; 82B from the live queue is not sent twice
+    assert await anext(stream) == ": keep-alive\n\n"
+    await stream.aclose()
+
+
+class SlowRedis:
+    def __init__(self):
+        self.published = []
+        self.delays = iter([0.03, 0.02, 0.01])
+
+    async def publish(self, channel, message):
+        await asyncio.sleep(next(self.delays))
+        self.published.append(json.loads(message)["id"])
+
+
+@pytest.mark.asyncio
+async def test_relay_publishes_in_write_order(memory_client, monkeypatch):
+    redis = SlowRedis()
+    monkeypatch.setattr(changefeed, "redis_client", redis)
+    feed = ChangeFeed()
+    feed.mode = "local"
+    relayed = asyncio.Event()
+    monkeypatch.setattr(feed, "follow_relay", relayed.wait)
+    running = asyncio.create_task(feed._run_local())
+    await asyncio.sleep(0)
+
+    document = await config.database.allocations.find_one({})
+    for _ in range(3):
+        feed.record(document, document)
+    while len(redis.published) < 3:
+        await asyncio.sleep(0.01)
+    assert redis.published == [f"{feed._epoch}-{sequence}" for sequence in (1, 2, 3)]
+
+    relayed.set()
+    await running
+    await asyncio.sleep(0)
+    assert feed._relay_task.cancelled()
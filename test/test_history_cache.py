@@ -0,0 +1,107 @@
+import json
+
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import config
+import routes.routes as routes
+from conftest import tomorrow
+
+
+@pytest.mark.asyncio
+async def test_rename_invalidates_pages_filtered_by_other_reference(api, memory_client, monkeypatch):
+    monkeypatch.setattr(routes, "RENAME_SWEEP_DELAY", 0)
+    response = await api.get("/api/allocations/history", params={"employee_id": "EMP001"})
+    assert response.json()[0]["vehicle_name"] == "Honda Civic"
+
+    response = await api.patch("/api/vehicles/VEH002", json={"vehicle_name": "Honda Jazz"})
+    assert response.status_code == 200
+
+    response = await api.get("/api/allocations/history", params={"employee_id": "EMP001"})
+    assert response.json()[0]["vehicle_name"] == "Honda Jazz"
+
+
+@pytest.mark.asyncio
+async def test_rolled_back_series_invalidates_history(api, memory_client, monkeypatch):
+    # A page cached between the insert and the compensating delete
+    insert_many = config.database.allocations.insert_many
+
+    async def insert_then_read(documents, **options):
+        try:
+            return await insert_many(documents, **options)
+        finally:
+            await api.get("/api/allocations/history", params={"employee_id": "EMP001"})
+
+    with monkeypatch.context() as patch:
+        patch.setattr(config.database.allocations, "insert_many", insert_then_read)
+        # The $in conflict check misses a booking made concurrently
+        patch.setattr(routes.database.allocations, "find", lambda *args, **kwargs: EmptyCursor())
+        response = await api.post("/api/allocations/series", json={
+            "employee_id": "EMP001", "vehicle_id": "VEH002",
+            "start_date": tomorrow().isoformat(), "end_date": tomorrow(3).isoformat()
+        })
+    assert response.status_code == 400
+
+    response = await api.get("/api/allocations/history", params={"employee_id": "EMP001"})
+    assert len(response.json()) == 1
+
+
+class EmptyCursor:
+    async def to_list(self, length=None):
+        return []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fast_serialization", [False, True])
+async def test_rows_without_names_are_filled(api, memory_client, monkeypatch, fast_serialization):
+    monkeypatch.setattr(routes, "FAST_SERIALIZATION", fast_serialization)
+    await config.database.allocations.update_many(
+        {}, {"$unset": {"employee_name": "", "vehicle_name": "", "driver_name": ""}}
+    )
+
+    response = await api.get("/api/allocations/history", params={"employee_id": "EMP001"})
+    assert response.status_code == 200, response.text
+    allocation = response.json()[0]
+    assert (allocation["employee_name"], allocation["vehicle_name"], allocation["driver_name"]) == (
+        "John Doe", "Honda Civic", "Jane Roe"
+    )
+
+    response = await api.get("/api/allocations/export", params={"format": "ndjson"})
+    assert response.status_code == 200, response.text
+    assert json.loads(response.text.splitlines()[0])["vehicle_name"] == "Honda Civic"
+
+
+@pytest.mark.asyncio
+async def test_rename_sweep_rewrites_late_bookings(api, memory_client, monkeypatch):
+    monkeypatch.setattr(routes, "RENAME_SWEEP_DELAY", 0.05)
+    response = await api.patch("/api/vehicles/VEH002", json={"vehicle_name": "Honda Jazz"})
+    assert response.json()["allocations_updated"] == 1
+
+    # Booked by a worker whose cache still had the old name
+    await config.database.allocations.insert_one({
+        "employee_id": "EMP001", "vehicle_id": "VEH002", "driver_id": "DRV002",
+        "allocation_date": datetime.combine(tomorrow(2), datetime.min.time()), "status": "active",
+        "created_at": datetime.utcnow(), "updated_at": datetime.utcnow(),
+        "employee_name": "John Doe", "vehicle_name": "Honda Civic", "driver_name": "Jane Roe"
+    })
+    await asyncio.gather(*routes.rename_sweeps)
+    assert await config.database.allocations.count_documents({"vehicle_name": "Honda Civic"}) == 0
+
+
+@pytest.mark.asyncio
+async def test_export_merges_tiers_newest_first(api, memory_client):
+    database = config.database
+    row = {"employee_id": "EMP001", "vehicle_id": "VEH001", "driver_id": "DRV001", "status": "completed",
+           "employee_name": "John Doe", "vehicle_name": "Toyota Camry", "driver_name": "Mike Smith"}
+    # A live row older than an archived one, not archived yet
+    await database.allocations_archive.insert_many([
+        {**row, "allocation_date": datetime(2020, 1, 3)}, {**row, "allocation_date": datetime(2020, 1, 1)}
+    ])
+    await database.allocations.insert_one({**row, "allocation_date": datetime(2020, 1, 2)})
+
+    response = await api.get("/api/allocations/export", params={"format": "ndjson", "batch_size": 2})
+    assert response.status_code == 200, response.text
+    dates = [json.loads(line)["allocation_date"][:10] for line in response.text.splitlines()]
+    assert dates == [tomorrow().isoformat(), "2020-01-03", "2020-01-02", "2020-01-01"]
@@ -0,0 +1,125 @@
+import asyncio
+import base64
+import hashlib
+import json
+
+import pytest
+
+import config
+import idempotency
+from conftest import tomorrow
+
+KEY = "3f1c9a7e-retry"
+STORE_KEY = f"idem:POST:/api/allocations:{KEY}"
+
+
+def body(days=2):
+    return {"employee_id": "EMP001", "vehicle_id": "VEH001", "allocation_date": tomorrow(days).isoformat()}
+
+
+async def post(api, payload=None, key=KEY):
+    return await api.post("/api/allocations", json=payload or body(), headers={"Idempotency-Key": key})
+
+
+def inserts(memory_client):
+    return [call for call in memory_client.calls if call == ("allocations", "insert_one")]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_insert_once(api, memory_client):
+    memory_client.latency = 0.05
+    first, second = await asyncio.gather(post(api), post(api))
+
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert len(inserts(memory_client)) == 1
+    assert [first.headers.get("idempotent-replayed"), second.headers.get("idempotent-replayed")].count("true") == 1
+
+
+@pytest.mark.asyncio
+async def test_retry_is_replayed_without_running_the_route(api, memory_client):
+    first = await post(api)
+    memory_client.calls.clear()
+
+    retry = await post(api)
+    assert retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert memory_client.calls == []
+
+
+@pytest.mark.asyncio
+async def test_key_reused_with_another_body_is_rejected(api, memory_client):
+    await post(api)
+    response = await post(api, body(days=3))
+    assert response.status_code == 422
+    assert len(inserts(memory_client)) == 1
+
+
+@pytest.mark.asyncio
+async def test_server_errors_are_not_stored(api, memory_client, monkeypatch):
+    with monkeypatch.context() as patch:
+        async def unavailable(*args, **kwargs):
+            raise RuntimeError("primary stepped down")
+        patch.setattr(config.database.allocations, "insert_one", unavailable)
+        response = await post(api)
+    assert response.status_code == 500
+
+    retry = await post(api)
+    assert retry.status_code == 200
+    assert "idempotent-replayed" not in retry.headers
+    assert len(inserts(memory_client)) == 1
+
+
+async def hold_lock_then(store, release):
+    # Another process is running the same request
+    await store.set(f"{STORE_KEY}:lock", "1", ex=30)
+    await asyncio.sleep(0.1)
+    await release()
+
+
+@pytest.mark.asyncio
+async def test_waits_for_the_process_holding_the_lock(api, memory_client):
+    store = idempotency.shared_store
+    content = json.dumps(body()).encode()
+    fingerprint = hashlib.sha256(b"\0".join([b"POST", b"/api/allocations", b"", content])).hexdigest()
+    stored = {"allocation_id": "from-the-other-process"}
+
+    async def save_response():
+        await store.set(STORE_KEY, json.dumps({
+            "fingerprint": fingerprint,
+            "status": 200,
+            "headers": [["content-type", "application/json"]],
+            "body": base64.b64encode(json.dumps(stored).encode()).decode()
+        }))
+        await store.delete(f"{STORE_KEY}:lock")
+
+    locked = asyncio.create_task(hold_lock_then(store, save_response))
+    await asyncio.sleep(0)
+    response = await api.post(
+        "/api/allocations", content=content,
+        headers={"Idempotency-Key": KEY, "Content-Type": "application/json"}
+    )
+    await locked
+
+    assert response.status_code == 200
+    assert response.json() == stored
+    assert response.headers["idempotent-replayed"] == "true"
+    assert inserts(memory_client) == []
+
+
+@pytest.mark.asyncio
+async def test_runs_itself_when_the_lock_is_given_up(api, memory_client):
+    store = idempotency.shared_store
+
+    async def give_up():
+        await store.delete(f"{STORE_KEY}:lock")
+
+    locked = asyncio.create_task(hold_lock_then(store, give_up))
+    await asyncio.sleep(0)
+    response = await post(api)
+    await locked
+
+    assert response.status_code == 200
+    assert "idempotent-replayed" not in response.headers
+    assert len(inserts(memory_client)) == 1
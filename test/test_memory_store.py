@@ -0,0 +1,25 @@
+import pytest
+from cache import MemoryRedis
+
+
+@pytest.mark.asyncio
+async def test_expired_keys_are_purged_without_being_read(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+    store = MemoryRedis(maxsize=10000)
+    for number in range(MemoryRedis.PURGE_INTERVAL - 1):
+        await store.set(f"idem:{number}", "1", ex=60)
+    now[0] += 61
+    await store.set("fresh", "1", ex=60)
+    assert list(store._data) == ["fresh"]
+
+
+@pytest.mark.asyncio
+async def test_size_bound_evicts_expiring_keys_only():
+    store = MemoryRedis(maxsize=100)
+    await store.incr("hist:gen:all")
+    for number in range(500):
+        await store.set(f"key:{number}", "1", ex=3600)
+    assert len(store._data) <= 100
+    assert await store.get("hist:gen:all") == "1"
+    assert await store.get("key:499") == "1"
@@ -0,0 +1,23 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import tomorrow
+from occupancy import OccupancyIndex, occupancy_index
+
+
+@pytest.mark.asyncio
+async def test_writes_during_load_survive_the_swap(memory_client, monkeypatch):
+    read = OccupancyIndex._read
+    booking = {"vehicle_id": "VEH001", "allocation_date": datetime.combine(tomorrow(3), datetime.min.time()), "status": "active"}
+
+    async def read_then_write(self, fresh):
+        await read(self, fresh)
+        # Committed after the allocations scan, before the swap
+        occupancy_index.apply(None, booking)
+        occupancy_index.set_vehicle_status("VEH002", "maintenance")
+
+    monkeypatch.setattr(OccupancyIndex, "_read", read_then_write)
+    await occupancy_index.load()
+    assert not occupancy_index.is_free("VEH001", tomorrow(3))
+    assert occupancy_index.available(tomorrow(5), tomorrow(5)) == ["VEH001"]
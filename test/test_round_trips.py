@@ -0,0 +1,106 @@
+import pytest
+from conftest import tomorrow
+
+# Database round trips each hot endpoint may make per request, with cold
+# reference caches. Raise a budget only together with the change that
+# needs the extra query.
+CREATE_BUDGET = 4       # employee, vehicle and driver lookups + insert
+CREATE_WARM_BUDGET = 1  # insert only, references served from cache
+UPDATE_BUDGET = 1       # conflict check and update in one find_one_and_update
+DELETE_BUDGET = 2       # read the allocation + delete
+HISTORY_BUDGET = 1      # one aggregation per page
+HISTORY_META_BUDGET = 1  # page and counts from the same $facet aggregation
+SERIES_BUDGET = 5       # three lookups + one $in conflict check + insert_many
+
+
+def assert_budget(memory_client, budget):
+    calls = list(memory_client.calls)
+    memory_client.calls.clear()
+    assert len(calls) <= budget, f"{len(calls)} database calls, budget is {budget}: {calls}"
+
+
+async def create(api, vehicle_id="VEH001", days=2):
+    response = await api.post("/api/allocations", json={
+        "employee_id": "EMP001", "vehicle_id": vehicle_id, "allocation_date": tomorrow(days).isoformat()
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.mark.asyncio
+async def test_create_allocation_budget(api, memory_client):
+    await create(api)
+    assert_budget(memory_client, CREATE_BUDGET)
+
+    await create(api, days=3)
+    assert_budget(memory_client, CREATE_WARM_BUDGET)
+
+
+@pytest.mark.asyncio
+async def test_create_conflict_budget(api, memory_client):
+    response = await api.post("/api/allocations", json={
+        "employee_id": "EMP001", "vehicle_id": "VEH002", "allocation_date": tomorrow().isoformat()
+    })
+    assert response.status_code == 400
+    assert_budget(memory_client, CREATE_BUDGET)
+
+
+@pytest.mark.asyncio
+async def test_update_allocation_budget(api, memory_client):
+    allocation = await create(api)
+    memory_client.calls.clear()
+
+    response = await api.put(
+        f"/api/allocations/{allocation['allocation_id']}", json={"allocation_date": tomorrow(4).isoformat()}
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["allocation_date"].startswith(tomorrow(4).isoformat())
+    assert_budget(memory_client, UPDATE_BUDGET)
+
+
+@pytest.mark.asyncio
+async def test_delete_allocation_budget(api, memory_client):
+    allocation = await create(api)
+    memory_client.calls.clear()
+
+    response = await api.delete(f"/api/allocations/{allocation['allocation_id']}")
+    assert response.status_code == 200, response.text
+    assert_budget(memory_client, DELETE_BUDGET)
+
+
+@pytest.mark.asyncio
+async def test_history_budget(api, memory_client):
+    response = await api.get("/api/allocations/history", params={"employee_id": "EMP001"})
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    assert_budget(memory_client, HISTORY_BUDGET)
+
+    # A repeated page comes from the history cache
+    response = await api.get("/api/allocations/history", params={"employee_id": "EMP001"})
+    assert len(response.json()) == 1
+    assert_budget(memory_client, 0)
+
+
+@pytest.mark.asyncio
+async def test_history_meta_budget(api, memory_client):
+    await create(api)
+    memory_client.calls.clear()
+
+    response = await api.get("/api/allocations/history", params={"employee_id": "EMP001", "include_meta": "true"})
+    assert response.status_code == 200
+    page = response.json()
+    assert len(page["items"]) == 2
+    assert page["meta"]["total"] == 2
+    assert page["meta"]["by_vehicle"] == {"VEH001": 1, "VEH002": 1}
+    assert_budget(memory_client, HISTORY_META_BUDGET)
+
+
+@pytest.mark.asyncio
+async def test_series_budget(api, memory_client):
+    response = await api.post("/api/allocations/series", json={
+        "employee_id": "EMP001", "vehicle_id": "VEH001",
+        "start_date": tomorrow().isoformat(), "end_date": tomorrow(7).isoformat()
+    })
+    assert response.status_code == 200, response.text
+    assert response.json()["created"] == 7
+    assert_budget(memory_client, SERIES_BUDGET)
@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+
+import config
+import routes.routes as routes
+from conftest import tomorrow
+from occupancy import occupancy_index
+
+
+@pytest_asyncio.fixture
+async def fleet(memory_client, monkeypatch):
+    # VEH002 is booked tomorrow; VEH001 and VEH003 are free
+    database = config.database
+    await database.vehicles.insert_one({"vehicle_id": "VEH003", "vehicle_name": "Ford Focus", "status": "available"})
+    await database.drivers.insert_one({"driver_id": "DRV003", "name": "Sam Lee", "assigned_vehicle_id": "VEH003"})
+    await occupancy_index.load()
+    monkeypatch.setattr(routes, "STATUS_SWEEP_DELAY", 0)
+    memory_client.calls.clear()
+    yield database
+    await asyncio.gather(*routes.status_sweeps)
+
+
+async def booking(database, vehicle_id="VEH002"):
+    return await database.allocations.find_one({"vehicle_id": vehicle_id, "status": "active"})
+
+
+async def set_status(api, **body):
+    response = await api.patch("/api/vehicles/VEH002/status", json={"status": "maintenance", **body})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.mark.asyncio
+async def test_cancel_future_allocations(api, fleet):
+    summary = await set_status(api)
+    assert (summary["allocations_cancelled"], summary["allocations_reassigned"]) == (1, 0)
+    assert await booking(fleet) is None
+    assert (await fleet.vehicles.find_one({"vehicle_id": "VEH002"}))["status"] == "maintenance"
+    assert "VEH002" not in occupancy_index.available(tomorrow(), tomorrow())
+
+
+@pytest.mark.asyncio
+async def test_reassign_to_free_vehicle(api, fleet):
+    summary = await set_status(api, action="reassign")
+    assert summary["allocations_reassigned"] == 1
+    new_vehicle_id = summary["reassigned"][0]["vehicle_id"]
+    assert new_vehicle_id in ("VEH001", "VEH003")
+    moved = await booking(fleet, new_vehicle_id)
+    assert moved["driver_id"] == {"VEH001": "DRV001", "VEH003": "DRV003"}[new_vehicle_id]
+    assert not occupancy_index.is_free(new_vehicle_id, tomorrow())
+
+
+@pytest.mark.asyncio
+async def test_reassign_within_pool(api, fleet):
+    summary = await set_status(api, action="reassign", pool=["VEH003"])
+    assert [item["vehicle_id"] for item in summary["reassigned"]] == ["VEH003"]
+
+
+@pytest.mark.asyncio
+async def test_reassign_without_free_vehicle_in_pool_cancels(api, fleet):
+    summary = await set_status(api, status="retired", action="reassign", pool=["VEH002"])
+    assert (summary["allocations_cancelled"], summary["allocations_reassigned"]) == (1, 0)
+
+
+@pytest.mark.asyncio
+async def test_reassign_conflict_falls_back_to_cancel(api, fleet):
+    # Booked by another process: the occupancy index still shows both free
+    taken = await booking(fleet)
+    for vehicle_id in ("VEH001", "VEH003"):
+        await fleet.allocations.insert_one({
+            key: value for key, value in {**taken, "vehicle_id": vehicle_id}.items() if key != "_id"
+        })
+
+    summary = await set_status(api, action="reassign")
+    assert (summary["allocations_cancelled"], summary["allocations_reassigned"]) == (1, 0)
+    assert (await fleet.allocations.find_one({"_id": taken["_id"]}))["status"] == "cancelled"
+    assert await fleet.allocations.count_documents({"status": "active"}) == 2
+
+
+@pytest.mark.asyncio
+async def test_allocation_changed_meanwhile_is_skipped(api, fleet, monkeypatch):
+    pick = routes.pick_replacement_vehicles
+
+    async def cancelled_meanwhile(allocations, pool=None):
+        await fleet.allocations.update_many({}, {"$set": {"status": "cancelled"}})
+        return await pick(allocations, pool)
+
+    monkeypatch.setattr(routes, "pick_replacement_vehicles", cancelled_meanwhile)
+    summary = await set_status(api, action="reassign")
+    assert (summary["allocations_skipped"], summary["allocations_reassigned"]) == (1, 0)
+    assert occupancy_index.is_free("VEH001", tomorrow()) and occupancy_index.is_free("VEH003", tomorrow())
+
+
+@pytest.mark.asyncio
+async def test_sweep_cancels_late_bookings(api, fleet, monkeypatch):
+    monkeypatch.setattr(routes, "STATUS_SWEEP_DELAY", 0.05)
+    taken = await booking(fleet)
+    await set_status(api)
+    # Booked by a worker whose cache still had the vehicle as available
+    await fleet.allocations.insert_one({
+        **{key: value for key, value in taken.items() if key != "_id"}, "updated_at": datetime.utcnow()
+    })
+    await asyncio.gather(*routes.status_sweeps)
+    assert await booking(fleet) is None